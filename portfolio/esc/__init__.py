@@ -0,0 +1,78 @@
+"""Helpers for the Earth System Components portfolio notebooks.
+
+Vectorised and cached versions of the loops and cube calls that the
+notebooks of this book repeat from chapter to chapter. The notebooks still
+carry their own code; the module docstrings name the cells each helper
+replaces.
+"""
+
+from .anomalies import (iter_monthly_anomalies, monthly_anomalies,
+                        monthly_climatology)
+from .classification import (GPP_CLASSES, KOPPEN_GEIGER, Rule, classify,
+                             classify_dataset, koppen_geiger)
+from .climatology import dayofyear_climatology, value_at_argmax
+from .composites import composites
+from .correlation import correlation_map, correlation_maps
+from .cube import CUBES, ChunkCache, Cube, open_cube
+from .energy_balance import NakedPlanet, run_ensemble
+from .equilibrium import (elapsed_time, equilibrium_temperature,
+                          temperature_at, time_to_equilibrium)
+from .events import detect_events, event_frequency
+from .greenhouse import LayeredAtmosphere
+from .grid import REGIONS, cell_areas, regional_means, regional_sums
+from .indices import climate_indices
+from .integrators import DivergenceError, integrate, max_stable_step
+from .points import PixelStore, extract_points
+from .regions import RegionIndex
+from .shifts import class_shifts
+from .significance import correlation_significance
+from .smoothing import extremes, rolling_mean
+from .stations import station_anomalies
+from .zonal_ebm import ZonalEBM
+
+__all__ = [
+    'CUBES',
+    'ChunkCache',
+    'Cube',
+    'DivergenceError',
+    'GPP_CLASSES',
+    'KOPPEN_GEIGER',
+    'LayeredAtmosphere',
+    'NakedPlanet',
+    'PixelStore',
+    'REGIONS',
+    'RegionIndex',
+    'Rule',
+    'ZonalEBM',
+    'cell_areas',
+    'class_shifts',
+    'classify',
+    'classify_dataset',
+    'climate_indices',
+    'composites',
+    'correlation_map',
+    'correlation_maps',
+    'correlation_significance',
+    'dayofyear_climatology',
+    'detect_events',
+    'elapsed_time',
+    'equilibrium_temperature',
+    'event_frequency',
+    'extract_points',
+    'extremes',
+    'integrate',
+    'iter_monthly_anomalies',
+    'koppen_geiger',
+    'max_stable_step',
+    'monthly_anomalies',
+    'monthly_climatology',
+    'open_cube',
+    'regional_means',
+    'regional_sums',
+    'rolling_mean',
+    'run_ensemble',
+    'station_anomalies',
+    'temperature_at',
+    'time_to_equilibrium',
+    'value_at_argmax',
+]
@@ -0,0 +1,116 @@
+"""Monthly climatologies and anomalies in two streaming passes.
+
+``05-Anomalies`` and ``06-Global_correlation_maps`` compute
+
+    monthly = da.resample(time='M').mean()
+    anomalies = monthly.groupby('time.month') - monthly.groupby('time.month').mean()
+
+which reads the cube several times and keeps the intermediate cubes. Here the
+first pass accumulates per calendar month sums and counts of the monthly
+means, the second pass subtracts the climatology while streaming again, so
+every chunk is read at most twice and memory stays at a few maps per month.
+
+>>> clim = monthly_climatology(ds[['analysed_sst', 'air_temperature_2m']])
+>>> for month, anomaly in iter_monthly_anomalies(ds.air_temperature_2m):
+...     pass
+"""
+
+import numpy as np
+import xarray as xr
+
+from .streaming import iter_monthly_means, nansum_count, wrap
+
+
+class MonthlyAccumulator:
+    """Running per calendar month sums and counts of finite values.
+
+    ``add`` and ``remove`` take the month number (1-12) and a map; the
+    counts make the mean skip NaN exactly like xarray does.
+    """
+
+    def __init__(self):
+        self.total = None
+        self.count = None
+
+    def _init(self, values):
+        if self.total is None:
+            self.total = np.zeros((12,) + np.shape(values))
+            self.count = np.zeros((12,) + np.shape(values), dtype=np.int64)
+
+    def add(self, month, values):
+        self._init(values)
+        total, count = nansum_count(np.asarray(values)[None])
+        self.total[month - 1] += total
+        self.count[month - 1] += count
+
+    def remove(self, month, values):
+        total, count = nansum_count(np.asarray(values)[None])
+        self.total[month - 1] -= total
+        self.count[month - 1] -= count
+
+    def mean(self):
+        """Climatology of shape ``(12, ...)``, NaN where nothing was added."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.total / self.count, np.nan)
+
+
+def _month_number(month):
+    return month.astype(int) % 12 + 1
+
+
+def monthly_climatology(obj, size=None):
+    """Mean of the monthly means for every calendar month.
+
+    Same result as ``obj.resample(time='M').mean().groupby('time.month')
+    .mean()`` with a single pass over the data.
+
+    Parameters
+    ----------
+    obj : DataArray or Dataset
+        Data with a ``time`` dimension.
+    size : int, optional
+        Time steps per block, by default the time chunk size.
+
+    Returns
+    -------
+    DataArray or Dataset
+        With a ``month`` dimension (1-12) instead of ``time``.
+    """
+    acc = MonthlyAccumulator()
+    for month, mean in iter_monthly_means(obj, size):
+        acc.add(_month_number(month), mean)
+    return wrap(acc.mean(), obj, ['month'], {'month': np.arange(1, 13)})
+
+
+def iter_monthly_anomalies(obj, climatology=None, size=None):
+    """Yield ``(month, anomaly)`` for every month of the record.
+
+    ``climatology`` is the result of `monthly_climatology`, computed first
+    if not given. Only one monthly map is held at a time.
+    """
+    if climatology is None:
+        climatology = monthly_climatology(obj, size)
+    clim = np.asarray(_stacked(climatology).transpose('month', ...).values)
+    for month, mean in iter_monthly_means(obj, size):
+        yield month, mean - clim[_month_number(month) - 1]
+
+
+def monthly_anomalies(obj, climatology=None, size=None):
+    """Monthly anomalies of ``obj`` as DataArray or Dataset.
+
+    Loads the full result into memory; for global cubes iterate with
+    `iter_monthly_anomalies` instead. The time stamps are the first day of
+    each month.
+    """
+    months, maps = [], []
+    for month, anomaly in iter_monthly_anomalies(obj, climatology, size):
+        months.append(month)
+        maps.append(anomaly)
+    time = np.array(months, dtype='datetime64[M]').astype('datetime64[ns]')
+    return wrap(np.stack(maps), obj, ['time'], {'time': time})
+
+
+def _stacked(obj):
+    if isinstance(obj, xr.Dataset):
+        return obj.to_array('variable')
+    return obj
@@ -0,0 +1,319 @@
+"""Incremental execution of the book's notebooks.
+
+With ``execute_notebooks: force`` every build runs every cell against the
+remote cube again and the slow chapters run into the 600 s timeout. Instead
+the build now executes the notebooks itself, but only those that changed:
+
+    python -m esc.build            # execute what changed, then build the book
+    python -m esc.build --force    # execute everything
+    python -m esc.build -j 4 --memory-budget 16
+
+For every notebook of ``_toc.yml`` a key is computed from
+
+* the source of its code cells, chained so that the key of a cell covers
+  every cell above it,
+* the upstream inputs: a fingerprint of every cube the notebook opens (the
+  cube URL, variables and selections are part of the cell source already)
+  and the source of the ``esc`` package if the notebook imports it,
+* the kernel.
+
+If the key matches the one in ``_build/.esc_cache/manifest.json`` the
+outputs stored in the notebook are reused, otherwise the notebook is executed
+and the outputs are written back into it. ``_config.yml`` therefore sets
+``execute_notebooks: off`` and Jupyter Book only renders.
+
+Cells are only reused together with their notebook: to run a changed cell
+the kernel needs the state of all cells above it. The manifest still records
+the chained key of every cell, so ``--dry-run`` shows from which cell on a
+notebook changed.
+
+The chapters do not depend on each other, so they are executed concurrently
+in a process pool (``--jobs``), each with its own kernel. ``--memory-budget``
+keeps the expected peak memory of the running notebooks below a limit.
+
+Every executed cell is profiled (`esc.profiling`): wall time, peak memory of
+the kernel and the bytes read and chunks fetched from the cube end up in the
+manifest, in ``_build/.esc_cache/report.json`` and on the book page
+``build-report.md``.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import nbformat
+import yaml
+
+from .profiling import write_report
+
+BOOK = Path(__file__).resolve().parent.parent
+PACKAGE = Path(__file__).resolve().parent
+CACHE = Path('_build', '.esc_cache')
+
+# Expected peak memory of a notebook which was not executed before [bytes]
+DEFAULT_MEMORY = 2E9
+
+_URL = re.compile(r'''['"]([^'"]+\.zarr/?)['"]''')
+_IMPORTS_ESC = re.compile(r'^\s*(from|import)\s+esc\b', re.MULTILINE)
+_OPENS_CUBE = re.compile(r'\b(open_cube|Cube)\(')
+
+
+def read_config(book=BOOK):
+    with open(Path(book, '_config.yml')) as f:
+        return yaml.safe_load(f) or {}
+
+
+def chapters(book=BOOK):
+    """Paths of the notebooks listed in ``_toc.yml``, in order."""
+    with open(Path(book, '_toc.yml')) as f:
+        toc = yaml.safe_load(f)
+    files = [toc['root']]
+    def walk(entries):
+        for entry in entries:
+            if 'file' in entry:
+                files.append(entry['file'])
+            walk(entry.get('chapters', []) + entry.get('sections', []))
+    walk(toc.get('chapters', []))
+    for part in toc.get('parts', []):
+        walk(part.get('chapters', []))
+    paths = [Path(book, f).with_suffix('.ipynb') for f in files]
+    return [p for p in paths if p.exists()]
+
+
+def code_sources(nb):
+    return [cell.source for cell in nb.cells if cell.cell_type == 'code']
+
+
+def package_hash():
+    """Hash of the source of the ``esc`` package."""
+    h = hashlib.sha256()
+    for path in sorted(PACKAGE.glob('*.py')):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def upstream_inputs(nb):
+    """Inputs of a notebook which are not part of its source."""
+    from .cube import CUBES, fingerprint
+
+    source = '\n'.join(code_sources(nb))
+    urls = set(_URL.findall(source))
+    if _OPENS_CUBE.search(source):
+        urls.update(CUBES.values())
+    inputs = {url: fingerprint(url) for url in sorted(urls)}
+    if _IMPORTS_ESC.search(source):
+        inputs['esc'] = package_hash()
+    inputs['kernel'] = nb.metadata.get('kernelspec', {}).get('name')
+    return inputs
+
+
+def cell_keys(nb, inputs):
+    """Chained keys of the code cells; the last one is the notebook key."""
+    h = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode())
+    keys = []
+    for source in code_sources(nb):
+        h.update(source.encode())
+        h.update(b'\0')
+        keys.append(h.hexdigest())
+    return keys or [h.hexdigest()]
+
+
+def first_changed_cell(keys, cached_keys):
+    """Index of the first code cell whose key differs, None if none does."""
+    for i, key in enumerate(keys):
+        if i >= len(cached_keys) or cached_keys[i] != key:
+            return i
+    return None if len(keys) == len(cached_keys) else len(cached_keys)
+
+
+class Manifest:
+    """Keys and results of the last execution of every notebook."""
+
+    def __init__(self, book=BOOK):
+        self.path = Path(book, CACHE, 'manifest.json')
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def get(self, name):
+        return self.entries.get(name, {})
+
+    def update(self, name, **entry):
+        self.entries[name] = {**self.get(name), **entry}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.entries, indent=1, sort_keys=True))
+        tmp.replace(self.path)
+
+
+def execute_notebook(path, timeout=None, allow_errors=False, kernel=None):
+    """Execute the notebook at ``path`` in place.
+
+    ``kernel`` overrides the kernel named in the notebook metadata.
+
+    Returns a dict with ``status`` (``'ok'`` or ``'failed'``), ``error``,
+    ``wall_time`` [s], the per cell ``profile`` of
+    `esc.profiling.ProfilingClient` and the ``peak_memory`` [bytes] of the
+    kernel. The outputs are written back even if a cell fails.
+    """
+    from nbclient.exceptions import CellExecutionError
+
+    from .profiling import ProfilingClient
+
+    nb = nbformat.read(path, as_version=4)
+    kwargs = {'kernel_name': kernel} if kernel else {}
+    client = ProfilingClient(nb, timeout=timeout, allow_errors=allow_errors,
+                             resources={'metadata': {'path': str(path.parent)}},
+                             **kwargs)
+    start = time.perf_counter()
+    status, error = 'ok', None
+    try:
+        client.execute()
+    except CellExecutionError as exc:
+        status, error = 'failed', f'{exc.ename}: {exc.evalue}'
+    except (TimeoutError, RuntimeError) as exc:
+        status, error = 'failed', f'{type(exc).__name__}: {exc}'.splitlines()[0]
+    wall_time = time.perf_counter() - start
+    nbformat.write(nb, path)
+    peaks = [cell['peak_rss'] for cell in client.profile if cell['peak_rss']]
+    return {'status': status, 'error': error, 'wall_time': wall_time,
+            'profile': client.profile, 'peak_memory': max(peaks, default=None)}
+
+
+def plan(book=BOOK, force=False, manifest=None):
+    """Notebooks to execute as list of ``(path, keys, first changed cell)``."""
+    manifest = manifest or Manifest(book)
+    todo = []
+    for path in chapters(book):
+        nb = nbformat.read(path, as_version=4)
+        if not code_sources(nb):
+            continue
+        keys = cell_keys(nb, upstream_inputs(nb))
+        entry = manifest.get(path.name)
+        cached = entry.get('cells', []) if entry.get('status') == 'ok' else []
+        changed = 0 if force else first_changed_cell(keys, cached)
+        if changed is not None:
+            todo.append((path, keys, changed))
+    return todo
+
+
+def schedule(todo, submit, jobs, memory_budget=None, estimate=None):
+    """Run ``submit(item)`` for all items, at most ``jobs`` at a time.
+
+    ``submit`` returns a future. An item is only started while the estimated
+    memory (``estimate(item)`` in bytes) of all running items stays within
+    ``memory_budget``; one item is always allowed to run. Yields
+    ``(item, result)`` in the order the items finish.
+    """
+    pending = list(todo)
+    running = {}
+    while pending or running:
+        used = sum(need for _, need in running.values())
+        for item in list(pending):
+            if len(running) >= jobs:
+                break
+            need = estimate(item) if estimate else 0
+            if running and memory_budget and used + need > memory_budget:
+                continue
+            running[submit(item)] = (item, need)
+            used += need
+            pending.remove(item)
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            item, _ = running.pop(future)
+            yield item, future.result()
+
+
+def run(book=BOOK, force=False, timeout=None, allow_errors=False,
+        kernel=None, dry_run=False, jobs=None, memory_budget=None,
+        log=print):
+    """Execute the changed notebooks of the book, return the manifest.
+
+    Independent notebooks run concurrently in a pool of ``jobs`` processes,
+    each with its own kernel. ``memory_budget`` [bytes] bounds the sum of
+    the expected peak memory of the running notebooks, taken from their
+    last execution (`DEFAULT_MEMORY` if unknown).
+    """
+    book = Path(book)
+    if timeout is None:
+        timeout = read_config(book).get('execute', {}).get('timeout')
+    manifest = Manifest(book)
+    todo = plan(book, force, manifest)
+    if not todo:
+        log('all notebooks are up to date')
+    for path, keys, changed in todo:
+        log(f'{path.name}: changed from code cell {changed}')
+    if dry_run or not todo:
+        return manifest
+
+    def estimate(item):
+        return manifest.get(item[0].name).get('peak_memory') or DEFAULT_MEMORY
+
+    # start the notebooks which took longest last time first
+    todo.sort(key=lambda item: -manifest.get(item[0].name).get('wall_time', 0))
+    jobs = jobs or os.cpu_count() or 1
+    start = time.perf_counter()
+    with ProcessPoolExecutor(min(jobs, len(todo))) as pool:
+        def submit(item):
+            return pool.submit(execute_notebook, item[0], timeout,
+                               allow_errors, kernel)
+        for (path, keys, _), result in schedule(todo, submit, jobs,
+                                                memory_budget, estimate):
+            # the notebook now contains outputs, its code cells are unchanged
+            manifest.update(path.name, cells=keys, **result)
+            manifest.save()
+            log(f'{path.name}: {result["status"]} in '
+                f'{result["wall_time"]:.1f} s'
+                + (f' ({result["error"]})' if result['error'] else ''))
+    elapsed = time.perf_counter() - start
+    total = sum(manifest.get(path.name)['wall_time'] for path, _, _ in todo)
+    log(f'executed {len(todo)} notebook(s) in {elapsed:.1f} s '
+        f'({total:.1f} s of notebook time)')
+    write_report(manifest, book)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m esc.build',
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument('book', nargs='?', default=BOOK, type=Path)
+    parser.add_argument('--force', action='store_true',
+                        help='execute all notebooks')
+    parser.add_argument('--timeout', type=int, default=None,
+                        help='per cell timeout [s], default from _config.yml')
+    parser.add_argument('--allow-errors', action='store_true')
+    parser.add_argument('--kernel', default=None,
+                        help='kernel to use instead of the notebook kernels')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='notebooks executed in parallel, default: cores')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='memory shared by the running notebooks [GB]')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only show what would be executed')
+    parser.add_argument('--execute-only', action='store_true',
+                        help='do not run jupyter-book afterwards')
+    args = parser.parse_args(argv)
+
+    budget = args.memory_budget * 1E9 if args.memory_budget else None
+    manifest = run(args.book, args.force, args.timeout, args.allow_errors,
+                   args.kernel, args.dry_run, args.jobs, budget)
+    failed = [name for name, entry in manifest.entries.items()
+              if entry.get('status') == 'failed']
+    if args.dry_run or args.execute_only:
+        return 1 if failed else 0
+    return subprocess.call(['jupyter-book', 'build', str(args.book)])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
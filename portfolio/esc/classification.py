@@ -0,0 +1,231 @@
+"""Climate classification from rule tables.
+
+``08-Climate_classifications`` assigns its four classes with a nested
+``xr.where``. Here a classification is a table of `Rule` entries, evaluated
+in order; the first rule a pixel satisfies gives its class. All rules are
+evaluated on whole NumPy blocks and the result is a ``uint8`` map (0 where
+no rule applies, e.g. pixels without data), chunk by chunk on dask arrays.
+
+Two tables are included:
+
+* `GPP_CLASSES`, the four classes of the notebook: temperature and
+  precipitation at the day of the GPP peak compared to their annual mean,
+* `KOPPEN_GEIGER`, the 30 Koppen-Geiger classes of Beck et al. (2018) from
+  monthly climatologies of temperature and precipitation.
+
+>>> clim = dayofyear_climatology(ds[['gross_primary_productivity',
+...                                  'air_temperature_2m', 'precipitation']])
+>>> classes = classify_dataset(gpp_features(clim), GPP_CLASSES)
+
+>>> monthly = monthly_climatology(ds[['air_temperature_2m', 'precipitation']])
+>>> temp, precip = cube_units(monthly.air_temperature_2m, monthly.precipitation)
+>>> kg = koppen_geiger(temp, precip)
+"""
+
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+import xarray as xr
+
+from .climatology import value_at_argmax
+
+Rule = namedtuple('Rule', ['code', 'name', 'test'])
+Rule.__doc__ = """Class ``code`` (1-255) for pixels where ``test(f)`` is True.
+
+``test`` takes the features as attributes of ``f`` and returns a boolean
+array; comparisons with NaN are False, so missing data falls through.
+"""
+
+ZERO_CELSIUS = 273.15  # [K]
+DAYS_PER_MONTH = np.array([31, 28.25, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def classify(features, rules, fill=0):
+    """Class map of the first matching rule per pixel.
+
+    Parameters
+    ----------
+    features : mapping or namespace of arrays
+        Feature maps of the same shape.
+    rules : sequence of Rule
+        Evaluated in order, rules only see pixels which are still open.
+    fill : int
+        Class of pixels no rule applies to.
+
+    Returns
+    -------
+    ndarray of uint8
+    """
+    if not isinstance(features, SimpleNamespace):
+        features = SimpleNamespace(**features)
+    shape = np.broadcast(*vars(features).values()).shape
+    classes = np.full(shape, fill, dtype=np.uint8)
+    open_ = np.ones(shape, dtype=bool)
+    for rule in rules:
+        hit = open_ & rule.test(features)
+        classes[hit] = rule.code
+        open_ &= ~hit
+    return classes
+
+
+def classify_dataset(ds, rules, fill=0):
+    """`classify` the data variables of ``ds`` block by block."""
+    names = list(ds.data_vars)
+
+    def block(*arrays):
+        return classify(dict(zip(names, arrays)), rules, fill)
+
+    return xr.apply_ufunc(block, *(ds[name] for name in names),
+                          dask='parallelized', output_dtypes=[np.uint8])
+
+
+def labels(rules):
+    """Names of the classes by code, e.g. for colorbar ticks."""
+    return {rule.code: rule.name for rule in rules}
+
+
+# classes of 08-Climate_classifications, pixels on the mean stay 0
+GPP_CLASSES = (
+    Rule(1, 'Warm and Wet',
+         lambda f: (f.temp_at_peak > f.temp) & (f.precip_at_peak > f.precip)),
+    Rule(2, 'Cool and Dry',
+         lambda f: (f.temp_at_peak < f.temp) & (f.precip_at_peak < f.precip)),
+    Rule(3, 'Warm and Dry',
+         lambda f: (f.temp_at_peak > f.temp) & (f.precip_at_peak < f.precip)),
+    Rule(4, 'Cool and Wet',
+         lambda f: (f.temp_at_peak < f.temp) & (f.precip_at_peak > f.precip)),
+)
+
+
+def gpp_features(clim, gpp='gross_primary_productivity',
+                 temp='air_temperature_2m', precip='precipitation',
+                 dim='dayofyear'):
+    """Features of `GPP_CLASSES` from a day of year climatology."""
+    at_peak = value_at_argmax(clim[gpp], clim[[temp, precip]], dim)
+    return xr.Dataset({
+        'temp_at_peak': at_peak[temp],
+        'temp': clim[temp].mean(dim),
+        'precip_at_peak': at_peak[precip],
+        'precip': clim[precip].mean(dim),
+    })
+
+
+def koppen_features(temp, precip):
+    """Features of `KOPPEN_GEIGER` from monthly climatologies.
+
+    ``temp`` [deg C] and ``precip`` [mm/month] have the 12 months on the
+    last axis. Summer is the warmer of October-March and April-September.
+    """
+    temp = np.asarray(temp, dtype=float)
+    precip = np.asarray(precip, dtype=float)
+    april_to_september = np.zeros(12, dtype=bool)
+    april_to_september[3:9] = True
+    north = temp[..., april_to_september].mean(-1) \
+        >= temp[..., ~april_to_september].mean(-1)
+    summer = np.where(north[..., None], april_to_september,
+                      ~april_to_september)
+    mat = temp.mean(-1)
+    map_ = precip.sum(-1)
+    summer_precip = np.where(summer, precip, 0).sum(-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summer_share = summer_precip / map_
+    threshold = np.where(summer_share > 0.7, 2 * mat + 28,
+                         np.where(summer_share < 0.3, 2 * mat, 2 * mat + 14))
+    with np.errstate(invalid='ignore'):
+        return SimpleNamespace(
+            mat=mat,
+            thot=temp.max(-1),
+            tcold=temp.min(-1),
+            tmon10=np.where(np.isnan(mat), np.nan, (temp > 10).sum(-1)),
+            map=map_,
+            pdry=precip.min(-1),
+            psdry=np.where(summer, precip, np.inf).min(-1),
+            pwdry=np.where(summer, np.inf, precip).min(-1),
+            pswet=np.where(summer, precip, -np.inf).max(-1),
+            pwwet=np.where(summer, -np.inf, precip).max(-1),
+            pthreshold=threshold)
+
+
+KOPPEN_GEIGER_NAMES = (
+    'Af', 'Am', 'Aw', 'BWh', 'BWk', 'BSh', 'BSk',
+    'Csa', 'Csb', 'Csc', 'Cwa', 'Cwb', 'Cwc', 'Cfa', 'Cfb', 'Cfc',
+    'Dsa', 'Dsb', 'Dsc', 'Dsd', 'Dwa', 'Dwb', 'Dwc', 'Dwd',
+    'Dfa', 'Dfb', 'Dfc', 'Dfd', 'ET', 'EF',
+)
+
+
+def _koppen_geiger_rules():
+    code = {name: i + 1 for i, name in enumerate(KOPPEN_GEIGER_NAMES)}
+    arid = lambda f: f.map < 10 * f.pthreshold
+    desert = lambda f: f.map < 5 * f.pthreshold
+    rules = [
+        Rule(code['EF'], 'EF', lambda f: f.thot <= 0),
+        Rule(code['ET'], 'ET', lambda f: f.thot < 10),
+        Rule(code['BWh'], 'BWh', lambda f: desert(f) & (f.mat >= 18)),
+        Rule(code['BWk'], 'BWk', desert),
+        Rule(code['BSh'], 'BSh', lambda f: arid(f) & (f.mat >= 18)),
+        Rule(code['BSk'], 'BSk', arid),
+        Rule(code['Af'], 'Af', lambda f: (f.tcold >= 18) & (f.pdry >= 60)),
+        Rule(code['Am'], 'Am',
+             lambda f: (f.tcold >= 18) & (f.pdry >= 100 - f.map / 25)),
+        Rule(code['Aw'], 'Aw', lambda f: f.tcold >= 18),
+    ]
+    groups = {
+        'C': lambda f: f.tcold > 0,
+        'D': lambda f: f.tcold <= 0,
+    }
+    precipitation = {
+        's': lambda f: (f.psdry < 40) & (f.psdry < f.pwwet / 3),
+        'w': lambda f: f.pwdry < f.pswet / 10,
+        'f': lambda f: np.isfinite(f.map),
+    }
+    # d is tested before c, which takes the rest
+    temperature = {
+        'a': lambda f: f.thot >= 22,
+        'b': lambda f: f.tmon10 >= 4,
+        'd': lambda f: f.tcold < -38,
+        'c': lambda f: f.tmon10 >= 1,
+    }
+    for group, in_group in groups.items():
+        for p, p_test in precipitation.items():
+            for t, t_test in temperature.items():
+                name = group + p + t
+                if name in code:
+                    rules.append(Rule(code[name], name,
+                                      lambda f, g=in_group, p=p_test, t=t_test:
+                                      g(f) & p(f) & t(f)))
+    return tuple(rules)
+
+
+# Beck et al. (2018), Present and future Koppen-Geiger climate
+# classification maps at 1-km resolution, Sci. Data 5, 180214; E is tested
+# before B, then A, C and D
+KOPPEN_GEIGER = _koppen_geiger_rules()
+
+
+def cube_units(temp, precip):
+    """Cube temperature [K] and precipitation [mm/day] to deg C and mm/month.
+
+    Both are monthly climatologies with a ``month`` dimension (1-12).
+    """
+    days = xr.DataArray(DAYS_PER_MONTH, dims='month',
+                        coords={'month': np.arange(1, 13)})
+    return temp - ZERO_CELSIUS, precip * days
+
+
+def koppen_geiger(temp, precip, dim='month'):
+    """Koppen-Geiger class map (codes of `KOPPEN_GEIGER`, 0 without data).
+
+    ``temp`` [deg C] and ``precip`` [mm/month] are monthly climatologies
+    along ``dim``, e.g. from `esc.anomalies.monthly_climatology` and
+    `cube_units`. Works chunk by chunk on dask arrays.
+    """
+    def block(t, p):
+        return classify(koppen_features(t, p), KOPPEN_GEIGER)
+
+    if temp.chunks is not None:
+        temp, precip = temp.chunk({dim: -1}), precip.chunk({dim: -1})
+    return xr.apply_ufunc(block, temp, precip,
+                          input_core_dims=[[dim], [dim]],
+                          dask='parallelized', output_dtypes=[np.uint8])
@@ -0,0 +1,149 @@
+"""Day of year climatologies of several variables in one pass.
+
+``08-Climate_classifications`` computes
+
+    gpp_mean = ds.gross_primary_productivity.groupby('time.dayofyear').mean()
+    temp_mean = ds.air_temperature_2m.groupby('time.dayofyear').mean()
+    precip_mean = ds.precipitation.groupby('time.dayofyear').mean()
+
+i.e. three passes over the global cube. `dayofyear_climatology` takes the
+variables as one Dataset and streams them together (`esc.streaming`), so the
+aligned chunks of all variables are read in the same block and the sums per
+day of year are accumulated once.
+
+>>> clim = dayofyear_climatology(ds[['gross_primary_productivity',
+...                                  'air_temperature_2m', 'precipitation']])
+>>> clim.gross_primary_productivity.max('dayofyear').plot()
+
+The temperature and precipitation at the day of the GPP peak are then an
+index gather with `value_at_argmax` instead of a masked copy of the
+climatology per variable:
+
+>>> at_peak = value_at_argmax(clim.gross_primary_productivity,
+...                           clim[['air_temperature_2m', 'precipitation']])
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .streaming import nansum_count, time_blocks, wrap
+
+
+class DayOfYearAccumulator:
+    """Running sums and counts of finite values per day of the year.
+
+    Only the days which occur in the data are stored (46 for the 8-daily
+    cube), so the memory is that of the ``groupby`` result.
+    """
+
+    def __init__(self):
+        self.total = {}
+        self.count = {}
+
+    def add(self, days, values):
+        """Add the maps ``values`` (time first) falling on ``days``."""
+        for day in np.unique(days):
+            total, count = nansum_count(values[days == day])
+            if day in self.total:
+                self.total[day] += total
+                self.count[day] += count
+            else:
+                self.total[day] = total
+                self.count[day] = count
+
+    def remove(self, days, values):
+        """Undo `add` for the same ``days`` and ``values``."""
+        for day in np.unique(days):
+            total, count = nansum_count(values[days == day])
+            self.total[day] -= total
+            self.count[day] -= count
+
+    def merge(self, other, sign=1):
+        """Add (``sign=1``) or remove (``sign=-1``) the sums of ``other``."""
+        for day, total in other.total.items():
+            if day in self.total:
+                self.total[day] += sign * total
+                self.count[day] += sign * other.count[day]
+            else:
+                self.total[day] = sign * total
+                self.count[day] = sign * other.count[day]
+
+    @property
+    def days(self):
+        return np.array(sorted(self.total), dtype=int)
+
+    def mean(self):
+        """Climatology with the days of `days` on the first axis."""
+        days = self.days
+        total = np.stack([self.total[day] for day in days])
+        count = np.stack([self.count[day] for day in days])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+
+def day_of_year(time):
+    """Day of the year (1-366) of datetime64 values, like ``time.dayofyear``."""
+    return pd.DatetimeIndex(time).dayofyear.values
+
+
+def dayofyear_climatology(obj, size=None):
+    """Mean over all years for every day of the year.
+
+    Same result as ``obj.groupby('time.dayofyear').mean()``, with all
+    variables of a Dataset read in a single pass over the cube.
+
+    Parameters
+    ----------
+    obj : DataArray or Dataset
+        Data with a ``time`` dimension.
+    size : int, optional
+        Time steps per block, by default the time chunk size.
+
+    Returns
+    -------
+    DataArray or Dataset
+        With a ``dayofyear`` dimension instead of ``time``.
+    """
+    acc = DayOfYearAccumulator()
+    for time, values in time_blocks(obj, size):
+        acc.add(day_of_year(time), values)
+    if not acc.total:
+        raise ValueError('no time steps to average')
+    return wrap(acc.mean(), obj, ['dayofyear'], {'dayofyear': acc.days})
+
+
+def _take_at_argmax(x, y):
+    """``y`` at the position of the maximum of ``x`` along the last axis."""
+    x = np.asarray(x, dtype=float)
+    valid = ~np.isnan(x).all(-1)
+    index = np.where(np.isnan(x), -np.inf, x).argmax(-1)
+    values = np.take_along_axis(y, index[..., None], -1)[..., 0]
+    return np.where(valid, values, np.nan)
+
+
+def value_at_argmax(x, y, dim='dayofyear'):
+    """Value of ``y`` where ``x`` is largest along ``dim``.
+
+    Same as ``y.where(y[dim] == x.idxmax(dim)).max(dim)`` but gathers one
+    value per pixel, so no masked copy of ``y`` is made. NaN in ``x`` is
+    skipped; pixels where ``x`` is all NaN get NaN. Works chunk by chunk on
+    dask arrays (``dim`` is merged into one chunk).
+
+    Parameters
+    ----------
+    x : DataArray
+        Variable whose maximum selects the position, e.g. the GPP
+        climatology.
+    y : DataArray or Dataset
+        Variables to gather at that position, sharing ``dim`` with ``x``.
+    dim : str
+        Dimension to search.
+    """
+    if x.chunks is not None:
+        x = x.chunk({dim: -1})
+    if y.chunks:
+        y = y.chunk({dim: -1})
+    return xr.apply_ufunc(_take_at_argmax, x, y,
+                          input_core_dims=[[dim], [dim]],
+                          dask='parallelized', output_dtypes=[float])
@@ -0,0 +1,89 @@
+"""Composites of cube variables around event dates.
+
+``05-Anomalies`` compares Australian precipitation, South American GPP and
+the Nino 3.4 SST by overlaying their smoothed curves. `composites` averages
+the monthly anomaly maps of any variables over the months of a set of
+events, e.g. the El Nino peaks of `esc.events.detect_events`, for every lead
+and lag at once: the anomalies are streamed month by month
+(`esc.anomalies.iter_monthly_anomalies`) and each map is added to the sums
+of the lags at which it follows an event, so all lags of all variables take
+one pass over the cube (plus one for the climatology if it is not given).
+
+>>> events = detect_events(climate_indices().oni)
+>>> el_nino = events[events.kind == 'el_nino'].peak
+>>> comp = composites(ds[['precipitation', 'gross_primary_productivity']],
+...                   el_nino, lags=range(-6, 13))
+>>> comp.mean.precipitation.sel(lag=3).plot()
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from .anomalies import iter_monthly_anomalies
+from .streaming import iter_monthly_means, wrap
+
+Composite = namedtuple('Composite', ['mean', 'count', 'n_events'])
+Composite.__doc__ = """Result of `composites`.
+
+mean : composite anomaly per lag, DataArray or Dataset like the input
+count : number of valid values averaged per lag and pixel
+n_events : number of events whose lagged month lies in the record, per lag
+"""
+
+
+def composites(obj, dates, lags=0, anomalies=True, climatology=None,
+               size=None):
+    """Mean monthly maps of ``obj`` ``lag`` months after each event date.
+
+    Parameters
+    ----------
+    obj : DataArray or Dataset
+        Cube variables with a ``time`` dimension.
+    dates : array_like of datetime64
+        Event dates; only their month is used.
+    lags : int or sequence of int
+        Months after the events, negative for months before. A sequence
+        adds a ``lag`` dimension.
+    anomalies : bool
+        Composite the monthly anomalies (the default) or the monthly means.
+    climatology : DataArray or Dataset, optional
+        From `esc.anomalies.monthly_climatology`, computed if not given.
+    size : int, optional
+        Time steps per block, by default the time chunk size.
+
+    Returns
+    -------
+    Composite
+    """
+    events = np.unique(np.asarray(dates, dtype='datetime64[M]'))
+    lag_list = np.atleast_1d(lags).astype(int)
+    position = {lag: i for i, lag in enumerate(lag_list)}
+    if anomalies:
+        maps = iter_monthly_anomalies(obj, climatology, size)
+    else:
+        maps = iter_monthly_means(obj, size)
+    total = count = None
+    n_events = np.zeros(len(lag_list), dtype=int)
+    for month, values in maps:
+        if total is None:
+            total = np.zeros((len(lag_list),) + values.shape)
+            count = np.zeros((len(lag_list),) + values.shape, dtype=np.int32)
+        # lags at which this month follows one of the events
+        offsets = (month - events).astype(int)
+        for lag in np.intersect1d(offsets, lag_list):
+            i = position[lag]
+            finite = np.isfinite(values)
+            total[i] += np.where(finite, values, 0.)
+            count[i] += finite
+            n_events[i] += (offsets == lag).sum()
+    if total is None:
+        raise ValueError('no time steps to composite')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    if np.ndim(lags) == 0:
+        return Composite(wrap(mean[0], obj, [], {}),
+                         wrap(count[0], obj, [], {}), int(n_events[0]))
+    coords = {'lag': lag_list}
+    return Composite(wrap(mean, obj, ['lag'], coords),
+                     wrap(count, obj, ['lag'], coords), n_events)
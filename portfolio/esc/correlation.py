@@ -0,0 +1,112 @@
+"""Correlation maps of many variables with one climate index.
+
+``06-Global_correlation_maps`` resamples the cube to monthly means and calls
+``xr.corr`` once per variable, i.e. one pass over the cube per map. Here the
+monthly means of all variables are streamed once (`esc.streaming`) and the
+running sums n, Sx, Sy, Sxx, Syy and Sxy are accumulated per pixel and lag,
+from which the Pearson correlation follows at the end.
+
+>>> r = correlation_maps(sst_anomaly_5month,
+...                      ds[['gross_primary_productivity', 'precipitation',
+...                          'air_temperature_2m']],
+...                      lags=range(-6, 7))
+>>> r.precipitation.sel(lag=3).plot()
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .streaming import iter_monthly_means, wrap
+
+
+class CorrelationAccumulator:
+    """Running sums for the Pearson correlation of x and y per element.
+
+    Pairs where either value is NaN are skipped, like ``xr.corr`` does.
+    Values are shifted by the first x seen to keep the sums well conditioned.
+    """
+
+    def __init__(self):
+        self.n = None
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.broadcast_to(np.asarray(y, dtype=float), x.shape)
+        if self.n is None:
+            self.shift_x = np.where(np.isfinite(x), x, 0.)
+            self.shift_y = np.where(np.isfinite(y), y, 0.)
+            self.n, self.sx, self.sy, self.sxx, self.syy, self.sxy = \
+                (np.zeros(x.shape) for _ in range(6))
+        valid = np.isfinite(x) & np.isfinite(y)
+        x = np.where(valid, x - self.shift_x, 0.)
+        y = np.where(valid, y - self.shift_y, 0.)
+        self.n += valid
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.syy += y * y
+        self.sxy += x * y
+
+    def correlation(self):
+        """Pearson correlation, NaN where fewer than two pairs were added."""
+        n = self.n
+        cov = n * self.sxy - self.sx * self.sy
+        var_x = n * self.sxx - self.sx**2
+        var_y = n * self.syy - self.sy**2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = cov / np.sqrt(var_x * var_y)
+        return np.where(n > 1, np.clip(r, -1, 1), np.nan)
+
+
+def _monthly_series(index):
+    """The index as pandas Series keyed by month."""
+    months = index['time'].values.astype('datetime64[M]')
+    series = pd.Series(np.asarray(index.values, dtype=float), index=months)
+    return series.groupby(level=0).mean()
+
+
+def correlation_maps(index, obj, lags=0, size=None):
+    """Correlate the monthly means of ``obj`` with a monthly ``index``.
+
+    Parameters
+    ----------
+    index : DataArray
+        Monthly time series, e.g. the smoothed Nino 3.4 SST anomaly. Only
+        the month of each time stamp is used for the matching.
+    obj : DataArray or Dataset
+        Cube variables with a ``time`` dimension, resampled to monthly means
+        on the fly; all variables are read in the same pass.
+    lags : int or sequence of int
+        Lag in months. For a positive lag the field follows the index, i.e.
+        ``obj`` in month t is correlated with ``index`` in month t - lag.
+        A sequence adds a ``lag`` dimension to the result.
+    size : int, optional
+        Time steps per block, by default the time chunk size.
+
+    Returns
+    -------
+    DataArray or Dataset
+        Correlation maps, the same type as ``obj``.
+    """
+    series = _monthly_series(index)
+    lag_list = np.atleast_1d(lags).astype(int)
+    accs = [CorrelationAccumulator() for _ in lag_list]
+    for month, mean in iter_monthly_means(obj, size):
+        for lag, acc in zip(lag_list, accs):
+            y = series.get(month - np.timedelta64(lag, 'M'), np.nan)
+            acc.add(mean, y)
+    if accs[0].n is None:
+        raise ValueError('no time steps to correlate')
+    maps = np.stack([acc.correlation() for acc in accs])
+    if np.ndim(lags) == 0:
+        return wrap(maps[0], obj, [], {})
+    return wrap(maps, obj, ['lag'], {'lag': lag_list})
+
+
+def correlation_map(index, da, lag=0, size=None):
+    """Shortcut for a single variable and lag, like ``xr.corr``."""
+    if not isinstance(da, xr.DataArray):
+        raise TypeError('correlation_map takes a DataArray, use '
+                        'correlation_maps for Datasets')
+    return correlation_maps(index, da, lag, size)
@@ -0,0 +1,496 @@
+"""Opening the Earth System Data Cube with a local chunk cache.
+
+The notebooks open the cube with
+
+    xr.open_zarr(fsspec.get_mapper(url), consolidated=True)
+
+which downloads every chunk again on each (forced) book build. `open_cube`
+does the same, but puts a `ChunkCache` between zarr and the HTTP mapper:
+chunks are kept on disk, the cache is bounded in size (least recently used
+chunks are evicted first), every cached chunk carries a checksum and in
+offline mode nothing is downloaded at all.
+
+>>> ds = open_cube()                    # time series friendly chunking
+>>> ds = open_cube(CUBES['space'])      # map friendly chunking
+>>> ds = open_cube(offline=True)        # only use what is in the cache
+
+`Cube` opens both chunkings and sends every selection to the one which has
+to read fewer chunks for it:
+
+>>> cube = Cube()
+>>> cube.select('air_temperature_2m', isel={'time': 1000})      # 'space'
+>>> cube.select('air_temperature_2m', sel={'lat': [51.3], 'lon': [12.3]},
+...             method='nearest')                               # 'time'
+>>> cube.reports[-1].bytes_fetched
+
+The defaults can be set with the environment variables ``ESC_CACHE_DIR``,
+``ESC_CACHE_SIZE`` (bytes) and ``ESC_OFFLINE``, e.g. for book builds.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+
+import fsspec
+import numpy as np
+import xarray as xr
+
+ESDC = 'http://data.rsc4earth.de/EarthSystemDataCube/v2.1.1/'
+CUBES = {
+    # 184 time steps x 90 x 90 pixels per chunk, good for time series
+    'time': ESDC + 'esdc-8d-0.25deg-184x90x90-2.1.1.zarr/',
+    # one global map per chunk, good for single time steps
+    'space': ESDC + 'esdc-8d-0.25deg-1x720x1440-2.1.1.zarr/',
+}
+
+CACHE_DIR = os.environ.get('ESC_CACHE_DIR',
+                           os.path.join(Path.home(), '.cache', 'esc'))
+CACHE_SIZE = int(float(os.environ.get('ESC_CACHE_SIZE', 20E9)))
+OFFLINE = os.environ.get('ESC_OFFLINE', '') not in ('', '0', 'false', 'False')
+
+# Totals over all caches of this process, read by the build profiler
+STATS = collections.Counter()
+
+_MAGIC = b'ESC1'
+_HEADER = struct.Struct('<4sB32sI')   # magic, missing flag, digest, key length
+_DATA, _MISSING = 0, 1
+# rescan the cache directory at least this often, other processes share it
+_RESCAN = 60.   # [s]
+
+
+class CacheMiss(OSError):
+    """A chunk is not in the cache and downloading is switched off."""
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def _is_metadata(key):
+    return key.rsplit('/', 1)[-1].startswith('.z')
+
+
+class ChunkCache(MutableMapping):
+    """Read only zarr store which caches the chunks of another store on disk.
+
+    Parameters
+    ----------
+    url : str
+        Location of the zarr store, anything ``fsspec.get_mapper`` accepts.
+    cache_dir : str, optional
+        Root directory of the cache, each store gets its own sub directory.
+    max_size : int, optional
+        Upper bound of the cache size of this store in bytes.
+    offline : bool, optional
+        Never access ``url``; chunks which are not cached raise `CacheMiss`.
+    mapper : MutableMapping, optional
+        Store to read from instead of ``fsspec.get_mapper(url)``.
+
+    Attributes
+    ----------
+    stats : collections.Counter
+        ``hits``, ``misses``, ``bytes_read`` (returned to zarr) and
+        ``bytes_fetched`` (downloaded) of this store.
+    """
+
+    def __init__(self, url, cache_dir=None, max_size=None, offline=None,
+                 mapper=None):
+        self.url = url
+        self.offline = OFFLINE if offline is None else offline
+        self.max_size = CACHE_SIZE if max_size is None else int(max_size)
+        name = hashlib.sha1(url.rstrip('/').encode()).hexdigest()[:16]
+        self.root = Path(cache_dir or CACHE_DIR) / name
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._mapper = mapper
+        self.stats = collections.Counter()
+        self._sizes = None
+        self._scanned = 0.
+        # (key, payload) downloaded by __contains__ for the next __getitem__
+        self._fetched = None
+
+    @property
+    def mapper(self):
+        if self._mapper is None:
+            self._mapper = fsspec.get_mapper(self.url)
+        return self._mapper
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return self.root / name[:2] / name
+
+    def _read(self, path):
+        """Return (key, flag, payload) of a cache file, None if absent or corrupt."""
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        if len(raw) >= _HEADER.size:
+            magic, flag, digest, n = _HEADER.unpack_from(raw)
+            key = raw[_HEADER.size:_HEADER.size + n]
+            payload = raw[_HEADER.size + n:]
+            if magic == _MAGIC and _digest(key + payload) == digest:
+                return key.decode(), flag, payload
+        self._remove(path)
+        return None
+
+    def _peek(self, path):
+        """Return (key, flag) from the header of a cache file, None if absent."""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return None
+                magic, flag, _, n = _HEADER.unpack(header)
+                key = f.read(n)
+        except FileNotFoundError:
+            return None
+        if magic != _MAGIC:
+            return None
+        return key.decode(errors='replace'), flag
+
+    def _write(self, key, flag, payload):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        encoded = key.encode()
+        header = _HEADER.pack(_MAGIC, flag, _digest(encoded + payload),
+                              len(encoded))
+        # write to a temporary file first so readers never see partial chunks
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header + encoded + payload)
+        os.replace(tmp, path)
+        size = len(header) + len(encoded) + len(payload)
+        self._index()[path] = size
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if self._sizes is not None:
+            self._sizes.pop(path, None)
+
+    def _index(self, rescan=False):
+        """Sizes of the cached files, scanned from disk on first use."""
+        if self._sizes is None or rescan:
+            sizes = {}
+            for path in self.root.glob('??/*'):
+                if path.name.startswith('.tmp'):
+                    continue
+                try:
+                    sizes[path] = path.stat().st_size
+                except FileNotFoundError:
+                    pass    # evicted by another process meanwhile
+            self._sizes = sizes
+            self._scanned = time.monotonic()
+        return self._sizes
+
+    @property
+    def size(self):
+        """Current size of the cache in bytes."""
+        return sum(self._index().values())
+
+    def _coordinates(self):
+        """Paths of the dimension coordinate arrays in the cached metadata."""
+        entry = self._read(self._path('.zmetadata'))
+        if entry is None or entry[1] != _DATA:
+            return set()
+        metadata = json.loads(entry[2]).get('metadata', {})
+        return {key[:-len('/.zattrs')] for key, attrs in metadata.items()
+                if key.endswith('/.zattrs') and attrs.get('_ARRAY_DIMENSIONS')
+                == [key[:-len('/.zattrs')].rsplit('/', 1)[-1]]}
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits ``max_size``.
+
+        Metadata (``.zmetadata``, ``.zarray``, ...) and the chunks of the
+        dimension coordinates are never evicted, they are needed to open the
+        store offline.
+        """
+        sizes = self._index()
+        total = sum(sizes.values())
+        if total > self.max_size or \
+                time.monotonic() - self._scanned > _RESCAN:
+            # other processes may have added or evicted files
+            sizes = self._index(rescan=True)
+            total = sum(sizes.values())
+        if total <= self.max_size:
+            return
+        def last_used(path):
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0.
+        # free a bit more than necessary to not evict on every write
+        target = 0.9 * self.max_size
+        keep = self._coordinates()
+        for path in sorted(sizes, key=last_used):
+            if total <= target:
+                break
+            entry = self._peek(path)
+            if entry is not None and (_is_metadata(entry[0])
+                                      or entry[0].rsplit('/', 1)[0] in keep):
+                continue
+            total -= sizes[path]
+            self._remove(path)
+
+    def _fetch(self, key):
+        """Download ``key`` into the cache, None if the store does not have it."""
+        if self.offline:
+            raise CacheMiss(f'{key!r} of {self.url} is not cached (offline mode)')
+        self._count(misses=1)
+        try:
+            payload = bytes(self.mapper[key])
+        except KeyError:
+            # absent chunks (fill value) are remembered as well, absent
+            # metadata is not, the store may just not be written yet
+            if not _is_metadata(key):
+                self._write(key, _MISSING, b'')
+            return None
+        self._write(key, _DATA, payload)
+        self._count(bytes_fetched=len(payload))
+        return payload
+
+    def __getitem__(self, key):
+        if self._fetched is not None and self._fetched[0] == key:
+            payload = self._fetched[1]
+            self._fetched = None
+        else:
+            path = self._path(key)
+            entry = self._read(path)
+            if entry is not None and entry[0] == key:
+                _, flag, payload = entry
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    pass    # evicted by another process meanwhile
+                self._count(hits=1)
+                if flag == _MISSING:
+                    raise KeyError(key)
+            else:
+                payload = self._fetch(key)
+                if payload is None:
+                    raise KeyError(key)
+        self._count(bytes_read=len(payload))
+        return payload
+
+    def _count(self, **counts):
+        self.stats.update(counts)
+        STATS.update(counts)
+
+    def __contains__(self, key):
+        # zarr asks for every chunk before reading it: cached chunks are
+        # answered from the file header, others are downloaded once and
+        # handed to the following __getitem__
+        entry = self._peek(self._path(key))
+        if entry is not None and entry[0] == key:
+            return entry[1] == _DATA
+        payload = self._fetch(key)
+        self._fetched = None if payload is None else (key, payload)
+        return payload is not None
+
+    def __iter__(self):
+        if self.offline:
+            for path in list(self._index()):
+                entry = self._read(path)
+                if entry is not None and entry[1] == _DATA:
+                    yield entry[0]
+        else:
+            yield from self.mapper
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __setitem__(self, key, value):
+        raise PermissionError('the cube cache is read only')
+
+    def __delitem__(self, key):
+        raise PermissionError('the cube cache is read only')
+
+    def clear_cache(self):
+        """Delete all cached chunks of this store."""
+        for path in list(self._index()):
+            self._remove(path)
+
+
+def _store(url, cache=None, cache_dir=None, max_size=None, offline=None):
+    """The zarr store for ``url``, a `ChunkCache` for remote stores by default."""
+    if cache is None:
+        cache = fsspec.utils.get_protocol(url) not in ('file', 'local')
+    if cache:
+        return ChunkCache(url, cache_dir, max_size, offline)
+    return fsspec.get_mapper(url)
+
+
+def open_cube(url=CUBES['time'], cache=None, cache_dir=None, max_size=None,
+              offline=None, **kwargs):
+    """Open a zarr cube, by default the ESDC with a local chunk cache.
+
+    Parameters
+    ----------
+    url : str
+        Location of the cube, e.g. one of `CUBES` or a path on the cluster.
+    cache : bool, optional
+        Use a `ChunkCache`. By default only remote stores are cached.
+    cache_dir, max_size, offline
+        Passed to `ChunkCache`.
+    **kwargs
+        Passed to ``xarray.open_zarr``.
+    """
+    kwargs.setdefault('consolidated', True)
+    return xr.open_zarr(_store(url, cache, cache_dir, max_size, offline),
+                        **kwargs)
+
+
+def fingerprint(url, offline=None, cache_dir=None):
+    """Hash of the consolidated metadata of the cube at ``url``.
+
+    Changes whenever the cube is rewritten (new version, variables, time
+    steps). The metadata is fetched directly; offline or if that fails the
+    cached copy is used. Returns None if neither is available.
+    """
+    offline = OFFLINE if offline is None else offline
+    data = None
+    if not offline:
+        try:
+            data = fsspec.get_mapper(url)['.zmetadata']
+        except (KeyError, OSError):
+            pass
+    if data is None:
+        try:
+            data = ChunkCache(url, cache_dir, offline=True)['.zmetadata']
+        except (KeyError, OSError):
+            return None
+    return hashlib.sha256(data).hexdigest()
+
+
+QueryReport = collections.namedtuple('QueryReport', [
+    'variable', 'layout', 'chunks', 'estimated_bytes', 'bytes_read',
+    'bytes_fetched'])
+QueryReport.__doc__ = """Record of one `Cube.select`.
+
+variable : name of the selected variable
+layout : name of the chunking the query was sent to
+chunks : number of chunks the selection touches in that layout
+estimated_bytes : uncompressed size of these chunks
+bytes_read, bytes_fetched : compressed bytes read from the cache and
+    downloaded while loading, None if not loaded or not cached
+"""
+
+
+def _positions(index, indexer, method=None):
+    """Integer positions selected by a label ``indexer`` on ``index``."""
+    if isinstance(indexer, slice):
+        return np.arange(len(index))[index.slice_indexer(
+            indexer.start, indexer.stop, indexer.step)]
+    labels = np.atleast_1d(indexer)
+    if isinstance(index, xr.CFTimeIndex) or labels.dtype.kind in 'OU':
+        # partial date strings like '2000-05' select whole periods
+        return np.concatenate([
+            np.atleast_1d(np.arange(len(index))[index.get_loc(label)])
+            for label in labels])
+    positions = index.get_indexer(labels, method=method)
+    if np.any(positions < 0):
+        raise KeyError(f'{labels[positions < 0]} not found in {index.name}')
+    return positions
+
+
+def count_chunks(positions, chunks):
+    """Number of chunks of size ``chunks`` (per dimension) the positions touch."""
+    total = 1
+    for dim, size in chunks.items():
+        total *= len(np.unique(np.asarray(positions[dim]) // size))
+    return total
+
+
+class Cube:
+    """The cube in several chunkings, queries are routed to the cheapest one.
+
+    Parameters
+    ----------
+    urls : dict, optional
+        Layout name to url, by default `CUBES`. All layouts must hold the
+        same data on the same grid.
+    **kwargs
+        ``cache``, ``cache_dir``, ``max_size`` and ``offline`` as for
+        `open_cube`, used for every layout.
+
+    Attributes
+    ----------
+    datasets : dict
+        The opened layouts.
+    reports : list of QueryReport
+        One entry per `select`.
+    """
+
+    def __init__(self, urls=None, **kwargs):
+        urls = CUBES if urls is None else urls
+        self.stores = {name: _store(url, **kwargs)
+                       for name, url in urls.items()}
+        self.datasets = {name: xr.open_zarr(store, consolidated=True)
+                         for name, store in self.stores.items()}
+        self.reports = []
+
+    def chunk_shape(self, layout, variable):
+        """Zarr chunk size per dimension of ``variable`` in ``layout``."""
+        da = self.datasets[layout][variable]
+        chunks = da.encoding.get('chunks') or tuple(c[0] for c in da.chunks)
+        return dict(zip(da.dims, chunks))
+
+    def plan(self, variable, isel=None, sel=None, method=None):
+        """Positions of a selection and the number of chunks per layout.
+
+        Returns ``(positions, chunks)`` where ``positions`` maps every
+        dimension to the selected integer positions (a scalar where the
+        selection drops the dimension) and ``chunks`` maps the layout names
+        to the number of chunks the selection touches.
+        """
+        da = next(iter(self.datasets.values()))[variable]
+        positions = {dim: np.arange(n) for dim, n in da.sizes.items()}
+        for dim, indexer in (isel or {}).items():
+            positions[dim] = positions[dim][indexer]
+        for dim, indexer in (sel or {}).items():
+            pos = _positions(da.indexes[dim], indexer, method)
+            scalar = np.ndim(indexer) == 0 \
+                and not isinstance(indexer, (slice, str))
+            positions[dim] = pos[0] if scalar else pos
+        chunks = {layout: count_chunks(
+                      {dim: np.atleast_1d(p) for dim, p in positions.items()},
+                      self.chunk_shape(layout, variable))
+                  for layout in self.datasets}
+        return positions, chunks
+
+    def select(self, variable, isel=None, sel=None, method=None, load=True):
+        """Select from ``variable`` in the layout which reads the fewest chunks.
+
+        ``isel`` and ``sel`` are dicts as for the xarray methods of the same
+        name, ``method`` applies to ``sel``. The result is loaded unless
+        ``load=False``; only loaded selections report the bytes read.
+        """
+        positions, chunks = self.plan(variable, isel, sel, method)
+        layout = min(chunks, key=chunks.get)
+        da = self.datasets[layout][variable]
+        result = da.isel(positions)
+
+        shape = self.chunk_shape(layout, variable)
+        estimated = chunks[layout] * int(np.prod(list(shape.values()))) \
+            * da.dtype.itemsize
+        stats = getattr(self.stores[layout], 'stats', None)
+        bytes_read = bytes_fetched = None
+        if load:
+            before = collections.Counter(stats)
+            result = result.load()
+            if stats is not None:
+                bytes_read = stats['bytes_read'] - before['bytes_read']
+                bytes_fetched = stats['bytes_fetched'] - before['bytes_fetched']
+        self.reports.append(QueryReport(variable, layout, chunks[layout],
+                                        estimated, bytes_read, bytes_fetched))
+        return result
@@ -0,0 +1,117 @@
+"""The naked planet energy balance model from ``02_Energy-balance``.
+
+The notebook advances a single scenario with a Python ``for`` loop. Here every
+parameter may be a scalar or an array; all of them are broadcast against each
+other, so one NumPy operation per time step advances the whole ensemble.
+
+Example: sweep 100 000 albedo/emissivity combinations
+
+>>> albedo, epsilon = np.meshgrid(np.linspace(0.2, 0.4, 316),
+...                               np.linspace(0.6, 1.0, 317))
+>>> temp = run_ensemble(np.arange(0, 1500, 20), albedo=albedo, epsilon=epsilon)
+>>> temp.shape
+(75, 317, 316)
+"""
+
+import numpy as np
+
+from .integrators import integrate
+
+# Same constants as in the notebook
+L = 1366.                   # solar constant [W/m2]
+ALBEDO = 0.3                # []
+DEPTH = 4000.               # depth of the ocean [m]
+RHO = 1000.                 # density of water [kg/m3]
+CAPACITY_WATER = 4.186      # heat capacity of water [J/g K]
+EPSILON = 1.                # []
+SIGMA = 5.67E-8             # Stefan-Boltzmann constant [W/(m2 K4)]
+SECONDS_PER_YEAR = 3.14E7   # [s]
+
+
+def heat_capacity(depth=DEPTH, rho=RHO, capacity_water=CAPACITY_WATER):
+    """Heat capacity of an ocean column per square meter [J/(m2 K)]."""
+    return depth * capacity_water * 10**3 * rho
+
+
+class NakedPlanet:
+    """An ensemble of naked planets.
+
+    Parameters
+    ----------
+    l : float or array_like
+        Solar constant [W/m2].
+    albedo : float or array_like
+        Planetary albedo [].
+    epsilon : float or array_like
+        Emissivity of the surface [].
+    depth : float or array_like
+        Depth of the ocean [m], sets the heat capacity.
+
+    All parameters are broadcast against each other; ``shape`` is the shape
+    of the resulting ensemble.
+    """
+
+    def __init__(self, l=L, albedo=ALBEDO, epsilon=EPSILON, depth=DEPTH):
+        l, albedo, epsilon, depth = np.broadcast_arrays(
+            np.asarray(l, dtype=float), np.asarray(albedo, dtype=float),
+            np.asarray(epsilon, dtype=float), np.asarray(depth, dtype=float))
+        self.l = l
+        self.albedo = albedo
+        self.epsilon = epsilon
+        self.depth = depth
+        self.capacity = heat_capacity(depth)
+
+    @property
+    def shape(self):
+        return self.l.shape
+
+    def heat_in(self):
+        """Absorbed solar radiation [W/m2]."""
+        return self.l * (1 - self.albedo) / 4
+
+    def heat_out(self, temp):
+        """Emitted long wave radiation [W/m2]."""
+        return self.epsilon * SIGMA * temp**4
+
+    def rate(self, temp):
+        """Temperature tendency dT/dt [K/year]."""
+        return (self.heat_in() - self.heat_out(temp)) \
+            * SECONDS_PER_YEAR / self.capacity
+
+    def jacobian(self, temp):
+        """Derivative of `rate` with respect to the temperature [1/year]."""
+        return -4 * self.epsilon * SIGMA * temp**3 \
+            * SECONDS_PER_YEAR / self.capacity
+
+    def run(self, time, temp0=0., method='euler', on_divergence='raise'):
+        """Integrate the model.
+
+        Parameters
+        ----------
+        time : array_like
+            Output times in years, e.g. ``np.arange(0, 1500, 20)``. The step
+            between two entries is the integration step.
+        temp0 : float or array_like
+            Temperature at ``time[0]`` [K], broadcast against the ensemble.
+        method, on_divergence : str
+            See `esc.integrators.integrate`. The default forward Euler step is
+            the one used in the notebook.
+
+        Returns
+        -------
+        numpy.ndarray
+            Temperatures of shape ``(len(time),) + shape`` [K].
+        """
+        return integrate(self, time, temp0, method=method,
+                         on_divergence=on_divergence).temp
+
+
+def run_ensemble(time, temp0=0., method='euler', on_divergence='mask',
+                 **params):
+    """Shortcut for ``NakedPlanet(**params).run(time, temp0, method)``.
+
+    Made for parameter sweeps, so by default members which diverge are set
+    to NaN instead of stopping the whole sweep.
+    """
+    return NakedPlanet(**params).run(time, temp0, method=method,
+                                     on_divergence=on_divergence)
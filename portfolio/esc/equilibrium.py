@@ -0,0 +1,100 @@
+"""Steady state of the naked planet without running the time loop.
+
+Setting heat_in = heat_out gives the equilibrium temperature
+
+    T_eq = ((L (1 - albedo) / 4) / (epsilon sigma))^(1/4)
+
+and the model equation C dT/dt = heat_in - epsilon sigma T^4 can be
+integrated in closed form, which gives the time needed to get within a
+tolerance of T_eq. Everything broadcasts over the parameter arrays.
+
+>>> equilibrium_temperature()  # notebook parameters
+254.8158...
+>>> time_to_equilibrium(tol=0.1, albedo=np.linspace(0.2, 0.4, 3))
+array([1303.6..., 1436.1..., 1606.0...])
+"""
+
+import numpy as np
+
+from .energy_balance import SECONDS_PER_YEAR, SIGMA, NakedPlanet
+
+
+def _model(model, params):
+    if model is None:
+        return NakedPlanet(**params)
+    if params:
+        raise TypeError('pass either a model or parameters, not both')
+    return model
+
+
+def equilibrium_temperature(model=None, **params):
+    """Temperature where heat_in equals heat_out [K].
+
+    Parameters
+    ----------
+    model : NakedPlanet, optional
+        The ensemble, otherwise one is created from ``params``.
+    **params
+        ``l``, ``albedo``, ``epsilon`` as for `NakedPlanet`.
+    """
+    model = _model(model, params)
+    return (model.heat_in() / (model.epsilon * SIGMA)) ** 0.25
+
+
+def _primitive(temp, temp_eq):
+    """Antiderivative of 1 / (temp_eq^4 - temp^4)."""
+    with np.errstate(divide='ignore'):
+        return (0.25 * np.log(np.abs((temp_eq + temp) / (temp_eq - temp)))
+                + 0.5 * np.arctan(temp / temp_eq)) / temp_eq**3
+
+
+def elapsed_time(temp, temp0=0., model=None, **params):
+    """Years the model needs to go from ``temp0`` to ``temp``.
+
+    Exact solution of the continuous model equation. It is infinite if
+    ``temp`` is the equilibrium temperature and NaN if ``temp`` is never
+    reached (on the other side of the equilibrium than ``temp0``).
+    """
+    model = _model(model, params)
+    temp_eq = equilibrium_temperature(model)
+    temp, temp0 = np.broadcast_arrays(np.asarray(temp, dtype=float),
+                                      np.asarray(temp0, dtype=float))
+    scale = model.capacity / (SECONDS_PER_YEAR * model.epsilon * SIGMA)
+    time = scale * (_primitive(temp, temp_eq) - _primitive(temp0, temp_eq))
+    reachable = (temp - temp0) * (temp_eq - temp) >= 0
+    return np.where(reachable, np.abs(time), np.nan)
+
+
+def time_to_equilibrium(tol=0.1, temp0=0., model=None, **params):
+    """Years until the temperature is within ``tol`` K of the equilibrium.
+
+    Zero where ``temp0`` already is within the tolerance.
+    """
+    model = _model(model, params)
+    temp_eq = equilibrium_temperature(model)
+    target = temp_eq - tol * np.sign(temp_eq - temp0)
+    time = elapsed_time(target, temp0, model)
+    return np.where(np.abs(temp_eq - temp0) <= tol, 0., time)
+
+
+def temperature_at(time, temp0=0., model=None, maxiter=60, **params):
+    """Temperature after ``time`` years, without time stepping.
+
+    Inverts `elapsed_time` with a vectorised bisection between ``temp0`` and
+    the equilibrium temperature; ``maxiter`` halvings give machine precision.
+    """
+    model = _model(model, params)
+    temp_eq = equilibrium_temperature(model)
+    time, temp0, temp_eq = np.broadcast_arrays(
+        np.asarray(time, dtype=float), np.asarray(temp0, dtype=float), temp_eq)
+    lower, upper = np.minimum(temp0, temp_eq), np.maximum(temp0, temp_eq)
+    warming = temp0 < temp_eq
+    for _ in range(maxiter):
+        mid = (lower + upper) / 2
+        # the time to reach mid grows monotonically towards the equilibrium
+        # from both sides; which bracket end moves depends on the direction
+        reached = elapsed_time(mid, temp0, model) <= time
+        move_lower = reached == warming
+        lower = np.where(move_lower, mid, lower)
+        upper = np.where(move_lower, upper, mid)
+    return (lower + upper) / 2
@@ -0,0 +1,126 @@
+"""ENSO events from the persistence of an index above a threshold.
+
+``05-Anomalies`` takes the two largest values of the smoothed Nino 3.4
+anomaly as the El Nino peaks. Here an event is a run of at least
+``min_duration`` consecutive steps beyond ``threshold``, the NOAA rule for
+the ONI being 0.5 K for 5 overlapping seasons. The runs are found with a
+run-length encoding of ``index >= threshold`` (El Nino) and
+``index <= -threshold`` (La Nina); NaN ends a run.
+
+`detect_events` returns the episodes of one series as a table,
+`event_frequency` applies the same rule to every pixel of a cube at once:
+
+>>> events = detect_events(climate_indices().oni)
+>>> freq = event_frequency(rolling_mean(monthly_anomalies(ds.analysed_sst),
+...                                     3, center=True))
+>>> freq.el_nino_per_year.plot()
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+KINDS = {'el_nino': 1, 'la_nina': -1}
+
+
+def runs(mask):
+    """Start and stop (exclusive) positions of the True runs of a 1-D mask."""
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    change = np.flatnonzero(padded[1:] != padded[:-1])
+    return change[::2], change[1::2]
+
+
+def detect_events(index, threshold=0.5, min_duration=5, dim='time'):
+    """Episodes of ``index`` beyond +-``threshold`` for ``min_duration`` steps.
+
+    Parameters
+    ----------
+    index : DataArray
+        One series, e.g. the ONI from `esc.indices.climate_indices`.
+    threshold : float
+        Anomaly an event has to reach in every step [units of ``index``].
+    min_duration : int
+        Minimum number of consecutive steps.
+    dim : str
+        Dimension of the series.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per event, ordered by start, with ``kind`` (``'el_nino'`` or
+        ``'la_nina'``), ``start``, ``end`` (last step), ``duration`` in
+        steps, ``peak`` (step of the largest anomaly), ``intensity`` (the
+        anomaly there) and ``mean`` anomaly.
+    """
+    values = np.asarray(index.values, dtype=float)
+    coord = index[dim].values
+    rows = []
+    for kind, sign in KINDS.items():
+        with np.errstate(invalid='ignore'):
+            beyond = sign * values >= threshold
+        for start, stop in zip(*runs(beyond)):
+            if stop - start < min_duration:
+                continue
+            episode = values[start:stop]
+            peak = start + np.argmax(sign * episode)
+            rows.append({'kind': kind, 'start': coord[start],
+                         'end': coord[stop - 1], 'duration': stop - start,
+                         'peak': coord[peak], 'intensity': values[peak],
+                         'mean': episode.mean()})
+    columns = ['kind', 'start', 'end', 'duration', 'peak', 'intensity', 'mean']
+    table = pd.DataFrame(rows, columns=columns)
+    return table.sort_values('start', ignore_index=True)
+
+
+def _run_lengths(mask):
+    """Length of the run of True ending at every step, along the last axis."""
+    count = np.cumsum(mask, axis=-1)
+    # count at the last False before each step, subtracted to restart runs
+    reset = np.maximum.accumulate(np.where(mask, 0, count), axis=-1)
+    return count - reset
+
+
+def _event_statistics(values, threshold, min_duration, sign):
+    """Number of events and of steps in events along the last axis."""
+    with np.errstate(invalid='ignore'):
+        beyond = sign * values >= threshold
+    length = _run_lengths(beyond)
+    # a run becomes an event when it reaches min_duration
+    events = (length == min_duration).sum(-1)
+    last = beyond & ~np.concatenate(
+        [beyond[..., 1:], np.zeros(beyond.shape[:-1] + (1,), bool)], -1)
+    steps = np.where(last & (length >= min_duration), length, 0).sum(-1)
+    return events, steps
+
+
+def event_frequency(da, threshold=0.5, min_duration=5, dim='time',
+                    steps_per_year=12):
+    """Local El Nino and La Nina like events of every pixel of ``da``.
+
+    The rule of `detect_events` is applied to the series of every pixel in
+    one vectorised pass, e.g. to smoothed monthly SST anomalies.
+
+    Returns
+    -------
+    Dataset
+        ``el_nino_count`` and ``la_nina_count`` (number of events),
+        ``*_fraction`` (fraction of the valid steps in events) and
+        ``*_per_year`` (events per year, ``steps_per_year`` steps a year).
+    """
+    da = da.transpose(..., dim)
+    values = np.asarray(da.values, dtype=float)
+    other = da.isel({dim: 0}, drop=True)
+    valid = np.isfinite(values).sum(-1)
+    result = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for kind, sign in KINDS.items():
+            events, steps = _event_statistics(values, threshold, min_duration,
+                                              sign)
+            result[f'{kind}_count'] = (other.dims, events)
+            result[f'{kind}_fraction'] = (other.dims,
+                                          np.where(valid > 0, steps / valid,
+                                                   np.nan))
+            result[f'{kind}_per_year'] = (other.dims,
+                                          np.where(valid > 0, events / valid
+                                                   * steps_per_year, np.nan))
+    return xr.Dataset(result, coords=other.coords)
@@ -0,0 +1,102 @@
+"""Naked planet with a greenhouse: N grey atmospheric layers.
+
+The notebook closes with the question how greenhouse gases could be added to
+the naked planet. Here the ocean surface keeps the heat_in/heat_out balance of
+`NakedPlanet`, above it sit ``layers`` atmospheric layers which are
+transparent for sunlight and absorb (and emit) a fraction ``layer_epsilon``
+of the long wave radiation. The layers hold no heat, they are in radiative
+equilibrium at every time step:
+
+    absorbed from below + absorbed from above = 2 * own emission
+
+Emission and absorption are linear in sigma T^4, so this is a linear system
+per ensemble member. Its right hand side is proportional to the surface
+emission, hence it is solved once for all members and layers in a batched
+``np.linalg.solve`` and every time step afterwards is as cheap as the naked
+planet. For opaque layers (``layer_epsilon=1``) the system is tridiagonal and
+the classic result T_s^4 = (N + 1) T_e^4 is recovered.
+
+>>> planet = LayeredAtmosphere(layers=50, layer_epsilon=np.linspace(0, 0.2, 10000))
+>>> temp = planet.run(np.arange(0, 1500, 5), method='implicit')
+"""
+
+import numpy as np
+
+from .energy_balance import ALBEDO, DEPTH, EPSILON, L, SIGMA, NakedPlanet
+
+
+class LayeredAtmosphere(NakedPlanet):
+    """An ensemble of planets with ``layers`` grey atmospheric layers.
+
+    Parameters
+    ----------
+    l, albedo, epsilon, depth : float or array_like
+        As for `NakedPlanet`, ``epsilon`` is the emissivity of the surface.
+    layers : int
+        Number of atmospheric layers.
+    layer_epsilon : float or array_like
+        Long wave emissivity (= absorptivity) of each layer [], broadcast
+        against the other parameters.
+
+    Attributes
+    ----------
+    epsilon : numpy.ndarray
+        Effective emissivity of the surface, i.e. the fraction of its
+        emission which is not returned by the atmosphere. With it the
+        methods of `NakedPlanet` and `esc.equilibrium` apply unchanged.
+    surface_epsilon : numpy.ndarray
+        Emissivity of the surface itself.
+    gain : numpy.ndarray
+        Emission of each layer relative to the surface emission, shape
+        ``shape + (layers,)``; layer 0 is the lowest.
+    """
+
+    def __init__(self, l=L, albedo=ALBEDO, epsilon=EPSILON, depth=DEPTH,
+                 layers=1, layer_epsilon=1.):
+        l, albedo, epsilon, depth, layer_epsilon = np.broadcast_arrays(
+            *(np.asarray(p, dtype=float)
+              for p in (l, albedo, epsilon, depth, layer_epsilon)))
+        super().__init__(l, albedo, epsilon, depth)
+        self.layers = int(layers)
+        self.layer_epsilon = layer_epsilon
+        self.surface_epsilon = self.epsilon
+
+        n = self.layers
+        e = layer_epsilon[..., None]
+        t = 1 - e
+        index = np.arange(n)
+        # transmission of everything below layer i, above layer i and between
+        # layers i and j (exclusive)
+        self._below = t ** index
+        self._above = t ** index[::-1]
+        distance = np.abs(index[:, None] - index[None, :])
+        off_diagonal = distance > 0
+        between = np.where(off_diagonal,
+                           t[..., None] ** np.maximum(distance - 1, 0), 0.)
+
+        system = 2 * np.eye(n) - e[..., None] * between
+        rhs = e * self._below
+        self.gain = np.linalg.solve(system, rhs[..., None])[..., 0]
+
+        back_radiation = np.sum(self._below * self.gain, axis=-1)
+        self.epsilon = self.surface_epsilon * (1 - back_radiation)
+
+    def olr(self, temp):
+        """Outgoing long wave radiation at the top of the atmosphere [W/m2]."""
+        transmission = self._above[..., 0] * (1 - self.layer_epsilon)
+        factor = transmission + np.sum(self._above * self.gain, axis=-1)
+        return factor * self.surface_epsilon * SIGMA * temp**4
+
+    def layer_temperatures(self, temp):
+        """Temperatures of the layers for the surface temperature ``temp`` [K].
+
+        Returns an array of shape ``np.shape(temp) + (layers,)``, layer 0 is
+        the lowest. Layers with zero emissivity have no defined temperature
+        and are NaN.
+        """
+        temp = np.asarray(temp, dtype=float)[..., None]
+        emission = self.gain * self.surface_epsilon[..., None] * SIGMA * temp**4
+        e = self.layer_epsilon[..., None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(e > 0, (emission / (e * SIGMA)) ** 0.25, np.nan)
+
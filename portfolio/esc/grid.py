@@ -0,0 +1,126 @@
+"""Cell areas of regular lat/lon grids and area weighted regional means.
+
+``04-Computation-concepts`` derives the cell area of the 2.5 deg grid by
+hand, ``06-Global_correlation_maps`` weights with ``cos(lat)`` and
+``05-Anomalies`` averages boxes with ``.mean('lat').mean('lon')``. Here
+every aggregation uses the exact area of the cells on the sphere,
+
+    A = R^2 (lon_e - lon_w) (sin lat_n - sin lat_s),
+
+computed once per grid and cached. Many regions are reduced at once: the
+area weights of all regions form one (region, lat, lon) array which is
+contracted with the data in a single ``einsum`` (``xr.dot``), chunk by
+chunk for dask arrays. Only the bounding box around all regions is read.
+
+>>> sst = regional_means(ds.analysed_sst, REGIONS)
+>>> sst.sel(region='nino34').plot()
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import xarray as xr
+
+RADIUS = 6.371E6  # [m]
+
+# boxes of the notebooks as selections on the cube (latitudes descending)
+REGIONS = {
+    'nino34': {'lat': slice(5, -5), 'lon': slice(-170, -120)},
+    'australia': {'lat': slice(-10, -45), 'lon': slice(110, 155)},
+    'south_america': {'lat': slice(5, -60), 'lon': slice(-85, -30)},
+}
+
+
+def cell_edges(centers, limit=None):
+    """Edges of cells around regularly spaced ``centers``, clipped to ``limit``."""
+    centers = np.asarray(centers, dtype=float)
+    if len(centers) == 1:
+        raise ValueError('cell edges need at least two centers')
+    mid = (centers[1:] + centers[:-1]) / 2
+    edges = np.concatenate([[2 * centers[0] - mid[0]], mid,
+                            [2 * centers[-1] - mid[-1]]])
+    if limit is not None:
+        edges = np.clip(edges, -limit, limit)
+    return edges
+
+
+@lru_cache(maxsize=16)
+def _areas(lat, lon, radius):
+    lat_edges = np.deg2rad(cell_edges(lat, 90))
+    lon_edges = np.deg2rad(cell_edges(lon))
+    band = np.abs(np.diff(np.sin(lat_edges)))
+    width = np.abs(np.diff(lon_edges))
+    areas = radius**2 * np.outer(band, width)
+    areas.flags.writeable = False
+    return areas
+
+
+def cell_areas(lat, lon, radius=RADIUS):
+    """Area [m2] of the cells of the grid, DataArray with dims (lat, lon).
+
+    ``lat`` and ``lon`` are the cell centres [deg], e.g. ``ds.lat`` and
+    ``ds.lon``. The areas are cached per grid.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return xr.DataArray(_areas(tuple(lat), tuple(lon), radius),
+                        dims=('lat', 'lon'), coords={'lat': lat, 'lon': lon},
+                        name='cell_area', attrs={'units': 'm2'})
+
+
+def region_weights(lat, lon, regions):
+    """Area of every cell in every region, dims (region, lat, lon).
+
+    ``regions`` maps names to selections like `REGIONS`; a region is the
+    cells its selection picks.
+    """
+    areas = cell_areas(lat, lon)
+    weights = []
+    for selection in regions.values():
+        inside = xr.zeros_like(areas, dtype=bool)
+        inside.loc[selection] = True
+        weights.append(areas.where(inside, 0.))
+    return xr.concat(weights, 'region').assign_coords(region=list(regions))
+
+
+def _bounding_box(weights, lat, lon):
+    """Slices of the rows and columns with a nonzero weight in any region."""
+    inside = (weights != 0).any('region')
+    box = {}
+    for dim, other in ((lat, lon), (lon, lat)):
+        index = np.flatnonzero(inside.any(other).values)
+        box[dim] = slice(index[0], index[-1] + 1) if len(index) else slice(0, 0)
+    return box
+
+
+def _reduce(da, regions, lat, lon, normalise):
+    weights = region_weights(da[lat], da[lon], regions) \
+        .rename({'lat': lat, 'lon': lon})
+    # only the chunks around the regions are read, not the whole globe
+    box = _bounding_box(weights, lat, lon)
+    da, weights = da.isel(box), weights.isel(box)
+    total = xr.dot(da.fillna(0.), weights, dim=[lat, lon])
+    if not normalise:
+        return total
+    area = xr.dot(da.notnull().astype(float), weights, dim=[lat, lon])
+    return total / area.where(area > 0)
+
+
+def regional_means(da, regions=REGIONS, lat='lat', lon='lon'):
+    """Area weighted mean of ``da`` in every region, skipping NaN.
+
+    Returns ``da`` with a ``region`` dimension instead of ``lat`` and
+    ``lon``. Regions without valid cells are NaN.
+    """
+    return _reduce(da, regions, lat, lon, True)
+
+
+def regional_sums(da, regions=REGIONS, lat='lat', lon='lon'):
+    """Area integral of ``da`` in every region (``da`` per m2 times m2)."""
+    return _reduce(da, regions, lat, lon, False)
+
+
+def global_mean(da, lat='lat', lon='lon'):
+    """Area weighted mean over the whole grid, skipping NaN."""
+    areas = cell_areas(da[lat], da[lon]).rename({'lat': lat, 'lon': lon})
+    return da.weighted(areas).mean([lat, lon])
@@ -0,0 +1,114 @@
+"""Climate indices computed once per cube version.
+
+``05-Anomalies`` and ``06-Global_correlation_maps`` both derive the Nino 3.4
+anomaly from ``analysed_sst``, one with a trailing 5-month pandas mean, the
+other with a centred ``rolling(time=5, center=True)``. `climate_indices`
+computes the standard indices in one pass over the boxes they need, stores
+them next to the chunk cache under the `esc.cube.fingerprint` of the cube
+and `VERSION` of the definitions, and afterwards only reads the store:
+
+>>> idx = climate_indices()
+>>> idx.oni.plot()
+>>> r = correlation_maps(idx.nino34_5month, ds.precipitation, lags=range(7))
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import xarray as xr
+
+from . import cube
+from .grid import REGIONS, regional_means
+
+# bump when the definitions below change, old results are then recomputed
+VERSION = 1
+
+INDEX_REGIONS = {
+    'nino34': REGIONS['nino34'],
+    # SST boxes around the SOI stations, Darwin and Tahiti
+    'darwin': {'lat': slice(-7.5, -17.5), 'lon': slice(125, 135)},
+    'tahiti': {'lat': slice(-12.5, -22.5), 'lon': slice(-155, -145)},
+}
+
+
+def _anomalies(monthly, base=None):
+    """Monthly series minus their climatology over the ``base`` years."""
+    reference = monthly.sel(time=slice(*base)) if base else monthly
+    clim = reference.groupby('time.month').mean()
+    return monthly.groupby('time.month') - clim
+
+
+def _standardised(series):
+    return (series - series.mean()) / series.std()
+
+
+def compute_indices(sst, base=None):
+    """Monthly climate indices from the sea surface temperature.
+
+    Parameters
+    ----------
+    sst : DataArray
+        ``analysed_sst`` of the cube [K] with dims (time, lat, lon).
+    base : tuple of str, optional
+        First and last year of the climatology, by default the full record.
+
+    Returns
+    -------
+    Dataset
+        Indexed by the first day of each month:
+
+        * ``nino34``: area weighted SST anomaly in the Nino 3.4 box [K],
+        * ``oni``: its 3-month centred mean (Oceanic Nino Index),
+        * ``nino34_5month``: its 5-month centred mean as in the notebooks,
+        * ``soi_sst``: standardised SST difference Darwin box minus Tahiti
+          box, a stand-in for the SOI (the cube has no sea level pressure)
+          with the same sign, i.e. positive during La Nina.
+    """
+    # one box at a time, their common bounding box spans most longitudes
+    boxes = xr.concat([regional_means(sst, {name: selection})
+                       for name, selection in INDEX_REGIONS.items()],
+                      'region').compute()
+    monthly = boxes.resample(time='MS').mean()
+    anomalies = _anomalies(monthly, base).drop_vars('month')
+    nino34 = anomalies.sel(region='nino34', drop=True)
+    difference = _standardised(anomalies.sel(region='darwin', drop=True)) \
+        - _standardised(anomalies.sel(region='tahiti', drop=True))
+    return xr.Dataset({
+        'nino34': nino34,
+        'oni': nino34.rolling(time=3, center=True).mean(),
+        'nino34_5month': nino34.rolling(time=5, center=True).mean(),
+        'soi_sst': _standardised(difference),
+    }, attrs={'version': VERSION})
+
+
+def store_path(digest, base=None, cache_dir=None):
+    """Location of the stored indices of the cube with fingerprint ``digest``."""
+    name = f'{digest[:32]}-v{VERSION}'
+    if base:
+        name += f'-{base[0]}-{base[1]}'
+    return Path(cache_dir or cube.CACHE_DIR, 'indices', name + '.zarr')
+
+
+def climate_indices(url=cube.CUBES['time'], variable='analysed_sst',
+                    base=None, refresh=False, cache_dir=None, offline=None):
+    """The indices of `compute_indices` for the cube at ``url``.
+
+    Served from the local store if they were computed for the same cube
+    version before, otherwise computed and stored. ``refresh`` recomputes.
+    Without a fingerprint (offline and nothing cached) nothing is stored.
+    """
+    digest = cube.fingerprint(url, offline, cache_dir)
+    path = store_path(digest, base, cache_dir) if digest else None
+    if path is not None and path.exists() and not refresh:
+        return xr.open_zarr(path).load()
+    ds = cube.open_cube(url, cache_dir=cache_dir, offline=offline)
+    indices = compute_indices(ds[variable], base)
+    if path is not None:
+        indices.attrs['fingerprint'] = digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        indices.to_zarr(tmp, mode='w')
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+    return indices
@@ -0,0 +1,249 @@
+"""Time integrators for the energy balance models.
+
+A model is anything with a ``rate(temp)`` method returning dT/dt in K/year;
+models with a stiff term also provide ``jacobian(temp)``, the (diagonal)
+derivative of the rate, which the implicit step needs.
+
+The notebook uses forward Euler, which only works up to a certain step
+(``max_stable_step``). RK4 allows a slightly larger step, the adaptive RK45
+picks the step from an error estimate and the implicit backward Euler step is
+stable for any step size.
+
+>>> from esc import NakedPlanet
+>>> sol = integrate(NakedPlanet(), np.arange(0, 1500, 100), method='implicit')
+>>> sol.temp[-1]  # ~254.2 K after 15 implicit steps
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+Solution = namedtuple('Solution', ['time', 'temp', 'nfev', 'diverged'])
+Solution.__doc__ = """Result of `integrate`.
+
+time : output times [years]
+temp : temperatures at the output times, shape ``(len(time),) + shape`` [K]
+nfev : number of evaluations of ``model.rate``
+diverged : boolean mask of ensemble members flagged as unstable
+"""
+
+# Amplification factor bound of the explicit schemes for dT/dt = J T
+STABILITY_LIMIT = {'euler': 2., 'rk4': 2.785}
+
+# Temperatures outside this range are considered diverged [K]
+MAX_TEMP = 1E4
+
+# Smallest step of the adaptive RK45 before a member counts as diverged
+MIN_STEP = 1E-6   # [years]
+
+
+class DivergenceError(FloatingPointError):
+    """Raised when an integration becomes numerically unstable."""
+
+    def __init__(self, time, diverged):
+        self.time = time
+        self.diverged = diverged
+        super().__init__(
+            f'{np.count_nonzero(diverged)} ensemble member(s) diverged at '
+            f't={time:g} years, use a smaller step or method="implicit"')
+
+
+class _Counter:
+    """Wrap ``model.rate`` and count the evaluations."""
+
+    def __init__(self, model):
+        self.model = model
+        self.nfev = 0
+
+    def __call__(self, temp):
+        self.nfev += 1
+        return self.model.rate(temp)
+
+
+def euler(rate, temp, dt, jacobian=None):
+    """Forward Euler step, as in the notebook."""
+    return temp + dt * rate(temp)
+
+
+def rk4(rate, temp, dt, jacobian=None):
+    """Classical fourth order Runge-Kutta step."""
+    k1 = rate(temp)
+    k2 = rate(temp + dt / 2 * k1)
+    k3 = rate(temp + dt / 2 * k2)
+    k4 = rate(temp + dt * k3)
+    return temp + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+def implicit(rate, temp, dt, jacobian, tol=1E-8, maxiter=50):
+    """Backward Euler step, solved with Newton iterations.
+
+    Solves ``new - temp - dt * rate(new) = 0`` element wise. Unconditionally
+    stable for the T^4 damping of the energy balance models.
+    """
+    new = temp + dt * rate(temp)
+    # start from the explicit guess unless it overshoots into negative values
+    new = np.where(new > 0, new, temp)
+    for _ in range(maxiter):
+        residual = new - temp - dt * rate(new)
+        delta = residual / (1 - dt * jacobian(new))
+        new = new - delta
+        if np.all(np.abs(delta) <= tol * np.maximum(np.abs(new), 1.)):
+            break
+    return new
+
+
+STEPPERS = {
+    'euler': euler,
+    'rk4': rk4,
+    'implicit': implicit,
+}
+
+# Dormand-Prince 5(4) tableau
+_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+_B5 = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+_B4 = np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200,
+                187 / 2100, 1 / 40])
+
+
+def _rk45_step(rate, temp, dt):
+    """One Dormand-Prince step, returns the new state and the error estimate."""
+    k = []
+    for a in _A:
+        y = temp
+        for aj, kj in zip(a, k):
+            y = y + dt * aj * kj
+        k.append(rate(y))
+    k = np.stack(k)
+    new = temp + dt * np.tensordot(_B5, k, axes=1)
+    err = dt * np.tensordot(_B5 - _B4, k, axes=1)
+    return new, err
+
+
+def _rk45(rate, temp, t0, t1, dt, rtol, atol):
+    """Advance from t0 to t1 with adaptive steps, return the state and last step.
+
+    All ensemble members share one step size, chosen by the worst member.
+    """
+    t = t0
+    # members masked by the caller are NaN already and do not count
+    alive = np.isfinite(temp)
+    while t < t1:
+        dt = min(dt, t1 - t)
+        new, err = _rk45_step(rate, temp, dt)
+        scale = atol + rtol * np.maximum(np.abs(temp), np.abs(new))
+        ratio = (np.abs(err) / scale)[alive]
+        norm = ratio.max() if ratio.size else 0.
+        if not np.isfinite(norm):
+            # the trial step overflowed, reject it and try a smaller one
+            if dt <= MIN_STEP:
+                # let the caller flag the diverged members
+                return new, dt
+            dt = max(0.2 * dt, MIN_STEP)
+            continue
+        if norm <= 1:
+            t += dt
+            temp = new
+        dt *= min(5., max(0.2, 0.9 * norm**-0.2)) if norm > 0 else 5.
+    return temp, dt
+
+
+def max_stable_step(model, method='euler', temp=None):
+    """Largest stable step [years] of an explicit method.
+
+    The limit comes from linearising the T^4 term around ``temp``, by default
+    the equilibrium temperature where the damping is strongest when warming
+    up from a cold start. The implicit method has no limit.
+    """
+    if method not in STABILITY_LIMIT:
+        return np.inf
+    if temp is None:
+        temp = _equilibrium(model)
+    return STABILITY_LIMIT[method] / np.abs(model.jacobian(temp))
+
+
+def _equilibrium(model):
+    """Equilibrium temperature from Newton iterations on ``model.rate``."""
+    temp = np.full(model.shape, 300.)
+    for _ in range(100):
+        temp = temp - model.rate(temp) / model.jacobian(temp)
+    return temp
+
+
+def _unstable(temp, delta, previous_delta):
+    """Members which left the physical range or oscillate with growing amplitude."""
+    bad = ~np.isfinite(temp) | (temp < 0) | (temp > MAX_TEMP)
+    if previous_delta is not None:
+        # ignore rounding noise around the equilibrium
+        bad |= (delta * previous_delta < 0) \
+            & (np.abs(delta) > np.abs(previous_delta)) \
+            & (np.abs(delta) > 1E-6 * np.abs(temp))
+    return bad
+
+
+def integrate(model, time, temp0=0., method='euler', on_divergence='raise',
+              rtol=1E-6, atol=1E-6):
+    """Integrate ``model`` and return the temperatures at ``time``.
+
+    Parameters
+    ----------
+    model : object
+        Provides ``rate(temp)``, ``shape`` and for ``method='implicit'``
+        ``jacobian(temp)``.
+    time : array_like
+        Output times [years]. For the fixed step methods the step between two
+        entries is the integration step, ``rk45`` chooses its own steps.
+    temp0 : float or array_like
+        Temperature at ``time[0]`` [K].
+    method : {'euler', 'rk4', 'rk45', 'implicit'} or callable
+        A callable must have the signature of `euler`.
+    on_divergence : {'raise', 'mask', 'ignore'}
+        What to do with unstable members: raise a `DivergenceError`, set them
+        to NaN and continue with the others, or keep integrating.
+    rtol, atol : float
+        Error tolerances of ``rk45``.
+
+    Returns
+    -------
+    Solution
+    """
+    if on_divergence not in ('raise', 'mask', 'ignore'):
+        raise ValueError(f'unknown on_divergence {on_divergence!r}')
+    time = np.asarray(time, dtype=float)
+    rate = _Counter(model)
+    jacobian = getattr(model, 'jacobian', None)
+    if method == 'implicit' and jacobian is None:
+        raise ValueError('the implicit method needs model.jacobian')
+    step = STEPPERS[method] if isinstance(method, str) and method != 'rk45' \
+        else method
+
+    temp = np.empty((len(time),) + tuple(model.shape))
+    temp[0] = temp0
+    diverged = np.zeros(model.shape, dtype=bool)
+    previous_delta = None
+    dt_adaptive = time[1] - time[0] if len(time) > 1 else 1.
+    for k in range(len(time) - 1):
+        dt = time[k + 1] - time[k]
+        with np.errstate(over='ignore', invalid='ignore'):
+            if method == 'rk45':
+                new, dt_adaptive = _rk45(rate, temp[k], time[k], time[k + 1],
+                                         dt_adaptive, rtol, atol)
+            else:
+                new = step(rate, temp[k], dt, jacobian)
+            delta = new - temp[k]
+            bad = _unstable(new, delta, previous_delta) & ~diverged
+        if on_divergence != 'ignore' and bad.any():
+            if on_divergence == 'raise':
+                raise DivergenceError(time[k + 1], bad)
+            diverged |= bad
+        new = np.where(diverged, np.nan, new)
+        temp[k + 1] = new
+        previous_delta = delta
+    return Solution(time, temp, rate.nfev, diverged)
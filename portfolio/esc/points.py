@@ -0,0 +1,185 @@
+"""Time series of many points from the cube.
+
+``05-Anomalies`` gets the Leipzig series with
+
+    ds.air_temperature_2m.sel(lat=[51.3], lon=[12.3], method='nearest')
+
+which reads whole chunks for a single pixel, once per point. Here the
+nearest cells of all points are found at once (direct index arithmetic on
+regular grids, a KD-tree on the unit sphere otherwise), the points are
+grouped by the spatial chunk they fall into and every chunk column is read
+once for all of its points.
+
+For repeated lookups `PixelStore` keeps a pixel-major copy (one row per
+pixel, time along the row) of a region in a memory-mapped file, so a series
+is a single contiguous read:
+
+>>> series = extract_points(ds.air_temperature_2m, stations.lat, stations.lon)
+>>> store = PixelStore.build(ds.air_temperature_2m, 'europe.npy',
+...                          lat=slice(72, 34), lon=slice(-25, 45))
+>>> leipzig = store.series(51.3, 12.3)
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+from scipy.spatial import cKDTree
+
+
+def _regular_step(values):
+    """Spacing of ``values`` if they are regularly spaced, else None."""
+    step = np.diff(values)
+    if len(step) and np.allclose(step, step[0], rtol=1E-6, atol=0):
+        return step[0]
+    return None
+
+
+def _unit_vectors(lat, lon):
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def nearest_cells(lat, lon, grid_lat, grid_lon):
+    """Indices ``(i, j)`` of the grid cells nearest to the points.
+
+    Regular grids are indexed directly (longitudes wrap around), other grids
+    are searched with a KD-tree of the cell centres on the unit sphere.
+    """
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+    grid_lat = np.asarray(grid_lat, dtype=float)
+    grid_lon = np.asarray(grid_lon, dtype=float)
+    dlat, dlon = _regular_step(grid_lat), _regular_step(grid_lon)
+    if dlat is not None and dlon is not None:
+        i = np.clip(np.rint((lat - grid_lat[0]) / dlat), 0, len(grid_lat) - 1)
+        j = np.rint((lon - grid_lon[0]) / dlon)
+        if abs(dlon * len(grid_lon)) >= 360 - 1E-6:
+            j %= len(grid_lon)
+        j = np.clip(j, 0, len(grid_lon) - 1)
+        return i.astype(int), j.astype(int)
+    glat, glon = np.meshgrid(grid_lat, grid_lon, indexing='ij')
+    tree = cKDTree(_unit_vectors(glat.ravel(), glon.ravel()))
+    _, k = tree.query(_unit_vectors(lat, lon))
+    return np.unravel_index(k, glat.shape)
+
+
+def _chunk_bounds(da, dim):
+    chunks = da.chunksizes.get(dim) if da.chunks else None
+    if chunks is None:
+        return np.array([0, da.sizes[dim]])
+    return np.concatenate([[0], np.cumsum(chunks)])
+
+
+def extract_points(da, lat, lon, names=None):
+    """Series of ``da`` at the cells nearest to the points.
+
+    Parameters
+    ----------
+    da : DataArray
+        Cube variable with ``lat`` and ``lon`` dimensions, lazily opened.
+    lat, lon : array_like
+        Coordinates of the points [deg].
+    names : array_like, optional
+        Labels of the points, by default their position.
+
+    Returns
+    -------
+    DataArray
+        ``da`` with a ``point`` dimension instead of lat and lon; the
+        coordinates ``lat`` and ``lon`` are those of the selected cells.
+    """
+    i, j = nearest_cells(lat, lon, da['lat'], da['lon'])
+    da = da.transpose(..., 'lat', 'lon')
+    lat_bounds = _chunk_bounds(da, 'lat')
+    lon_bounds = _chunk_bounds(da, 'lon')
+    chunk_i = np.searchsorted(lat_bounds, i, side='right') - 1
+    chunk_j = np.searchsorted(lon_bounds, j, side='right') - 1
+    shape = da.shape[:-2]
+    values = np.empty(shape + (len(i),), dtype=da.dtype)
+    groups = chunk_i * len(lon_bounds) + chunk_j
+    for group in np.unique(groups):
+        members = np.flatnonzero(groups == group)
+        # read the part of the chunk column which covers its points
+        rows = slice(i[members].min(), i[members].max() + 1)
+        cols = slice(j[members].min(), j[members].max() + 1)
+        block = np.asarray(da.isel(lat=rows, lon=cols).values)
+        values[..., members] = block[..., i[members] - rows.start,
+                                     j[members] - cols.start]
+    other = da.isel(lat=0, lon=0, drop=True)
+    point = np.arange(len(i)) if names is None else np.asarray(names)
+    return xr.DataArray(values, dims=other.dims + ('point',),
+                        coords={**other.coords, 'point': point,
+                                'lat': ('point', da['lat'].values[i]),
+                                'lon': ('point', da['lon'].values[j])},
+                        name=da.name, attrs=da.attrs)
+
+
+class PixelStore:
+    """Pixel-major copy of a cube variable for fast repeated series lookups.
+
+    The values are a memory-mapped ``.npy`` file of shape (lat * lon, time),
+    the coordinates a ``.json`` file next to it. Create it with `build`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads(self.path.with_suffix('.json').read_text())
+        self.name = meta['name']
+        self.time = np.array(meta['time'], dtype='datetime64[ns]')
+        self.lat = np.array(meta['lat'])
+        self.lon = np.array(meta['lon'])
+        self.values = np.load(self.path, mmap_mode='r')
+
+    @classmethod
+    def build(cls, da, path, **selection):
+        """Write the pixel-major copy of ``da.sel(**selection)`` to ``path``.
+
+        The region is read one spatial chunk column at a time, so the memory
+        used is one chunk column.
+        """
+        da = da.sel(**selection).transpose('time', 'lat', 'lon')
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        n_lat, n_lon = da.sizes['lat'], da.sizes['lon']
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=da.dtype,
+                                        shape=(n_lat * n_lon, da.sizes['time']))
+        lat_bounds = _chunk_bounds(da, 'lat')
+        lon_bounds = _chunk_bounds(da, 'lon')
+        for a, b in zip(lat_bounds[:-1], lat_bounds[1:]):
+            for c, d in zip(lon_bounds[:-1], lon_bounds[1:]):
+                block = np.asarray(da.isel(lat=slice(a, b),
+                                           lon=slice(c, d)).values)
+                rows = (np.arange(a, b)[:, None] * n_lon
+                        + np.arange(c, d)).ravel()
+                out[rows] = block.reshape(len(block), -1).T
+        out.flush()
+        del out
+        path.with_suffix('.json').write_text(json.dumps({
+            'name': da.name,
+            'time': [str(t) for t in da['time'].values],
+            'lat': da['lat'].values.tolist(),
+            'lon': da['lon'].values.tolist(),
+        }))
+        return cls(path)
+
+    def series(self, lat, lon, names=None):
+        """Series of the cells nearest to the points, dims (time, point).
+
+        A scalar ``lat`` and ``lon`` give a single series with dim time.
+        """
+        i, j = nearest_cells(lat, lon, self.lat, self.lon)
+        rows = i * len(self.lon) + j
+        values = self.values[rows].T
+        coords = {'time': self.time, 'lat': ('point', self.lat[i]),
+                  'lon': ('point', self.lon[j])}
+        if np.ndim(lat) == 0 and np.ndim(lon) == 0:
+            return xr.DataArray(values[:, 0], dims='time',
+                                coords={'time': self.time, 'lat': self.lat[i[0]],
+                                        'lon': self.lon[j[0]]},
+                                name=self.name)
+        coords['point'] = np.arange(len(rows)) if names is None else names
+        return xr.DataArray(values, dims=('time', 'point'), coords=coords,
+                            name=self.name)
@@ -0,0 +1,159 @@
+"""Per cell profile of the notebook executions of the book build.
+
+`ProfilingClient` executes a notebook like ``nbclient.NotebookClient`` and
+asks the kernel before and after every cell (with a silent user expression,
+nothing is added to the notebook's namespace and ``esc`` need not be
+importable) for
+
+* the peak resident memory of the kernel during the cell; on Linux the high
+  water mark is reset before each cell through ``/proc/self/clear_refs``,
+  elsewhere it is the peak since the kernel started,
+* the bytes read and the chunks fetched from the cube through
+  `esc.cube.ChunkCache`; cubes opened with plain ``fsspec`` are not seen and
+  count as 0,
+
+and measures the wall time of the cell. `write_report` turns the profiles
+of all chapters into ``_build/.esc_cache/report.json`` and the book page
+``build-report.md``.
+"""
+
+import ast
+import json
+import time
+from pathlib import Path
+
+from nbclient import NotebookClient
+
+REPORT_PAGE = 'build-report.md'
+REPORT_JSON = Path('_build', '.esc_cache', 'report.json')
+
+# Run in the kernel before and after every cell. Only the standard library
+# is used, so nothing has to be importable in the kernel
+_PROBE_SOURCE = """
+import json, resource, sys
+try:
+    # peak since the last probe: read the high water mark, then reset it
+    with open('/proc/self/status') as f:
+        peak = [int(line.split()[1]) * 1024 for line in f
+                if line.startswith('VmHWM:')][0]
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+except (OSError, IndexError, ValueError):
+    # peak since the start, ru_maxrss is in kB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak *= 1 if sys.platform == 'darwin' else 1024
+cube = sys.modules.get('esc.cube')
+result = json.dumps([peak, dict(getattr(cube, 'STATS', {}))])
+"""
+# a user expression, executed in a namespace of its own
+_PROBE = f"(lambda ns: (exec({_PROBE_SOURCE!r}, ns), ns['result'])[1])({{}})"
+
+
+def counters(probe):
+    """Kernel counters from the result of the probe expression."""
+    peak, stats = probe
+    return {'peak_rss': peak,
+            'bytes_read': stats.get('bytes_read', 0),
+            'chunks': stats.get('misses', 0),
+            'bytes_fetched': stats.get('bytes_fetched', 0)}
+
+
+class ProfilingClient(NotebookClient):
+    """Notebook client which records a profile of every code cell.
+
+    Attributes
+    ----------
+    profile : list of dict
+        One entry per executed code cell with ``cell`` (index in the
+        notebook), ``source`` (first line), ``wall_time`` [s], ``peak_rss``
+        (peak memory during the cell) [bytes], ``bytes_read``, ``chunks``
+        (fetched) and ``bytes_fetched``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profile = []
+
+    async def _probe(self):
+        try:
+            msg_id = self.kc.execute('', silent=True, store_history=False,
+                                     user_expressions={'probe': _PROBE})
+            reply = await self.async_wait_for_reply(msg_id)
+            data = reply['content']['user_expressions']['probe']
+            return counters(json.loads(
+                ast.literal_eval(data['data']['text/plain'])))
+        except Exception:  # e.g. a kernel which is not Python
+            return {}
+
+    async def async_execute_cell(self, cell, cell_index, *args, **kwargs):
+        if cell.cell_type != 'code' or not cell.source.strip():
+            return await super().async_execute_cell(cell, cell_index, *args,
+                                                    **kwargs)
+        before = await self._probe()
+        start = time.perf_counter()
+        try:
+            return await super().async_execute_cell(cell, cell_index, *args,
+                                                    **kwargs)
+        finally:
+            wall_time = time.perf_counter() - start
+            after = await self._probe() if self.kc else {}
+            entry = {'cell': cell_index,
+                     'source': cell.source.strip().splitlines()[0][:80],
+                     'wall_time': wall_time,
+                     'peak_rss': after.get('peak_rss')}
+            for key in ('bytes_read', 'chunks', 'bytes_fetched'):
+                if key in after:
+                    entry[key] = after[key] - before.get(key, 0)
+            self.profile.append(entry)
+
+
+def _size(n):
+    if n is None:
+        return ''
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(n) < 1000:
+            return f'{n:.0f} {unit}'
+        n /= 1000
+    return f'{n:.1f} TB'
+
+
+def write_report(manifest, book, top=20):
+    """Write the JSON report and the book page from the manifest entries."""
+    book = Path(book)
+    report = {name: {key: entry.get(key) for key in
+                     ('status', 'error', 'wall_time', 'peak_memory', 'profile')}
+              for name, entry in sorted(manifest.entries.items())}
+    path = book / REPORT_JSON
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=1))
+
+    lines = ['# Build report', '',
+             'Execution profile of the chapters from the last build with '
+             '`python -m esc.build`.', '',
+             'Cube reads and chunks (fetched, not served from the local '
+             'cache) are only counted for cubes opened with '
+             '`esc.open_cube`; they stay 0 for cubes opened with '
+             '`xr.open_zarr`.', '',
+             '## Chapters', '',
+             '| Notebook | Status | Wall time | Peak memory | Cube reads |',
+             '| --- | --- | ---: | ---: | ---: |']
+    cells = []
+    for name, entry in report.items():
+        profile = entry['profile'] or []
+        read = sum(c.get('bytes_read', 0) for c in profile)
+        lines.append(f"| {name} | {entry['status']} | "
+                     f"{entry['wall_time'] or 0:.1f} s | "
+                     f"{_size(entry['peak_memory'])} | {_size(read)} |")
+        cells += [(name, c) for c in profile]
+    cells.sort(key=lambda item: -item[1]['wall_time'])
+    lines += ['', '## Slowest cells', '',
+              '| Notebook | Cell | Wall time | Peak memory | Cube reads '
+              '| Chunks | Source |',
+              '| --- | ---: | ---: | ---: | ---: | ---: | --- |']
+    for name, c in cells[:top]:
+        source = c['source'].replace('|', '\\|').replace('`', "'")
+        lines.append(f"| {name} | {c['cell']} | {c['wall_time']:.2f} s | "
+                     f"{_size(c.get('peak_rss'))} | "
+                     f"{_size(c.get('bytes_read'))} | {c.get('chunks', '')} | "
+                     f"`{source}` |")
+    (book / REPORT_PAGE).write_text('\n'.join(lines) + '\n')
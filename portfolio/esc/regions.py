@@ -0,0 +1,224 @@
+"""Regional aggregation over polygons and masks with a sparse region index.
+
+``05-Anomalies`` and ``06-Global_correlation_maps`` cut regions as lat/lon
+boxes. A `RegionIndex` rasterises polygons (countries, basins, ...) or masks
+(biomes, land/sea) onto the cube grid once: every cell gets the fraction of
+its area inside each region, estimated from ``supersample`` x
+``supersample`` points per cell with ``matplotlib.path``. The weights
+(fraction times cell area) are stored as a sparse (region, pixel) matrix,
+so a block of maps is reduced to all regions by one sparse matrix product
+and a whole cube to a (time, region) table in one pass over the bounding box
+of the regions.
+
+>>> index = RegionIndex(ds.lat, ds.lon, {
+...     'nino34': box(lat=(5, -5), lon=(-170, -120)),
+...     'australia': box(lat=(-10, -45), lon=(110, 155)),
+... })
+>>> table = index.reduce(ds[['analysed_sst', 'precipitation']])
+>>> index.save('regions.npz')
+"""
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+from matplotlib.path import Path
+
+from .grid import cell_areas, cell_edges
+from .streaming import time_blocks
+
+
+def box(lat, lon):
+    """Vertices (lon, lat) of the box between the two ``lat`` and ``lon``."""
+    (south, north), (west, east) = sorted(lat), sorted(lon)
+    return [(west, south), (east, south), (east, north), (west, north)]
+
+
+def _as_paths(polygon):
+    """A polygon or a list of polygons (list of (lon, lat) vertices)."""
+    if isinstance(polygon, Path):
+        return [polygon]
+    array = np.asarray(polygon[0], dtype=float)
+    if array.ndim == 1:
+        return [Path(np.asarray(polygon, dtype=float))]
+    return [p for part in polygon for p in _as_paths(part)]
+
+
+def _overlapping(edges, low, high):
+    """Indices of the cells between ``edges`` which overlap (low, high)."""
+    lower = np.minimum(edges[:-1], edges[1:])
+    upper = np.maximum(edges[:-1], edges[1:])
+    return np.flatnonzero((upper > low) & (lower < high))
+
+
+def area_fractions(lat, lon, polygon, supersample=5):
+    """Fraction of the area of every cell inside ``polygon`` as (lat, lon).
+
+    ``polygon`` is a list of (lon, lat) vertices, a list of such lists
+    (parts and holes are added up, so holes must be separate regions), or a
+    ``matplotlib.path.Path``. Only cells within the bounding box are tested.
+    """
+    lat_edges = cell_edges(lat, 90)
+    lon_edges = cell_edges(lon)
+    fraction = np.zeros((len(lat), len(lon)))
+    offsets = (np.arange(supersample) + 0.5) / supersample
+    for path in _as_paths(polygon):
+        (west, south), (east, north) = path.get_extents().get_points()
+        rows = _overlapping(lat_edges, south, north)
+        cols = _overlapping(lon_edges, west, east)
+        if not len(rows) or not len(cols):
+            continue
+        # supersampled points of the cells in the bounding box
+        y = lat_edges[rows, None] + np.outer(np.diff(lat_edges)[rows], offsets)
+        x = lon_edges[cols, None] + np.outer(np.diff(lon_edges)[cols], offsets)
+        yy = np.broadcast_to(y[:, None, :, None], (len(rows), len(cols),
+                                                   supersample, supersample))
+        xx = np.broadcast_to(x[None, :, None, :], yy.shape)
+        inside = path.contains_points(np.column_stack([xx.ravel(), yy.ravel()]))
+        fraction[np.ix_(rows, cols)] += inside.reshape(yy.shape).mean((2, 3))
+    return np.clip(fraction, 0, 1)
+
+
+class RegionIndex:
+    """Sparse area weights of many regions on a lat/lon grid.
+
+    Parameters
+    ----------
+    lat, lon : array_like
+        Cell centres of the grid [deg], e.g. ``ds.lat`` and ``ds.lon``.
+    regions : dict
+        Region name to polygon (see `area_fractions`) or to a mask on the
+        grid (boolean or fraction of each cell, shape (lat, lon)).
+    supersample : int
+        Points per cell and axis to estimate the area fractions.
+
+    Attributes
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        (region, pixel) area inside the region [m2], pixels in the order of
+        ``values.reshape(..., lat * lon)``.
+    """
+
+    def __init__(self, lat, lon, regions, supersample=5):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.names = list(regions)
+        areas = cell_areas(self.lat, self.lon).values.ravel()
+        rows = []
+        for region in regions.values():
+            if np.shape(region) == (len(self.lat), len(self.lon)):
+                fraction = np.nan_to_num(np.asarray(region, dtype=float))
+            else:
+                fraction = area_fractions(self.lat, self.lon, region,
+                                          supersample)
+            rows.append(scipy.sparse.csr_matrix(fraction.ravel() * areas))
+        self.matrix = scipy.sparse.vstack(rows, format='csr') if rows else \
+            scipy.sparse.csr_matrix((0, areas.size))
+
+    @classmethod
+    def _from_matrix(cls, lat, lon, names, matrix):
+        index = cls.__new__(cls)
+        index.lat, index.lon, index.names = lat, lon, list(names)
+        index.matrix = matrix.tocsr()
+        return index
+
+    def save(self, path):
+        """Store the index as ``.npz`` to skip the rasterisation next time."""
+        np.savez_compressed(path, lat=self.lat, lon=self.lon,
+                            names=np.array(self.names),
+                            data=self.matrix.data, indices=self.matrix.indices,
+                            indptr=self.matrix.indptr,
+                            shape=np.array(self.matrix.shape))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            matrix = scipy.sparse.csr_matrix(
+                (f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            return cls._from_matrix(f['lat'], f['lon'], f['names'].tolist(),
+                                    matrix)
+
+    def area(self):
+        """Area of every region [m2] as DataArray."""
+        return xr.DataArray(np.asarray(self.matrix.sum(1)).ravel(),
+                            dims='region', coords={'region': self.names})
+
+    def _bounding_box(self):
+        """Box around the weighted cells as isel slices and matrix columns."""
+        pixels = np.unique(self.matrix.indices[self.matrix.data != 0])
+        if not len(pixels):
+            # keep one cell, the regions are all empty
+            pixels = np.array([0])
+        rows, cols = np.divmod(pixels, len(self.lon))
+        box = {'lat': slice(rows.min(), rows.max() + 1),
+               'lon': slice(cols.min(), cols.max() + 1)}
+        columns = (np.arange(box['lat'].start, box['lat'].stop)[:, None]
+                   * len(self.lon)
+                   + np.arange(box['lon'].start, box['lon'].stop)).ravel()
+        return box, self.matrix[:, columns]
+
+    def _reduce_block(self, values, mean, matrix):
+        """Reduce maps of shape (..., lat, lon) to (..., region)."""
+        shape = values.shape[:-2]
+        pixels = values.reshape(-1, values.shape[-2] * values.shape[-1]).T
+        valid = np.isfinite(pixels)
+        total = matrix @ np.where(valid, pixels, 0.)
+        if mean:
+            area = matrix @ valid.astype(float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                total = np.where(area > 0, total / area, np.nan)
+        return total.T.reshape(shape + (len(self.names),))
+
+    def reduce(self, obj, how='mean', size=None):
+        """Area weighted regional means (or integrals) of ``obj``.
+
+        Parameters
+        ----------
+        obj : DataArray or Dataset
+            Data on the grid of the index; all variables of a Dataset are
+            read in the same pass. With a ``time`` dimension the cube is
+            streamed block by block along time.
+        how : {'mean', 'sum'}
+            Mean skipping NaN, or the area integral (value times m2).
+        size : int, optional
+            Time steps per block, by default the time chunk size.
+
+        Returns
+        -------
+        DataArray or Dataset
+            ``obj`` with a ``region`` dimension instead of lat and lon.
+        """
+        if how not in ('mean', 'sum'):
+            raise ValueError(f'unknown reduction {how!r}')
+        mean = how == 'mean'
+        if 'time' in obj.dims:
+            return self._reduce_time(obj, mean, size)
+        if isinstance(obj, xr.Dataset):
+            return obj.map(self.reduce, how=how)
+        da = obj.transpose(..., 'lat', 'lon')
+        box, matrix = self._bounding_box()
+        values = self._reduce_block(
+            np.asarray(da.isel(box).values, dtype=float), mean, matrix)
+        other = da.isel(lat=0, lon=0, drop=True)
+        return xr.DataArray(values, dims=other.dims + ('region',),
+                            coords={**other.coords, 'region': self.names},
+                            name=da.name)
+
+    def _reduce_time(self, obj, mean, size):
+        obj = obj.transpose('time', ..., 'lat', 'lon')
+        # only the chunks around the regions are streamed, not the whole globe
+        box, matrix = self._bounding_box()
+        times, blocks = [], []
+        for time, values in time_blocks(obj.isel(box), size):
+            times.append(time)
+            blocks.append(self._reduce_block(np.asarray(values, dtype=float),
+                                             mean, matrix))
+        values = np.concatenate(blocks)
+        if isinstance(obj, xr.Dataset):
+            return xr.Dataset(
+                {name: (('time', 'region'), values[:, i])
+                 for i, name in enumerate(obj.data_vars)},
+                coords={'time': np.concatenate(times), 'region': self.names})
+        other = obj.isel(time=0, lat=0, lon=0, drop=True)
+        return xr.DataArray(values, dims=('time',) + other.dims + ('region',),
+                            coords={**other.coords, 'time': np.concatenate(times),
+                                    'region': self.names}, name=obj.name)
@@ -0,0 +1,155 @@
+"""Climate classes over sliding windows of years.
+
+``08-Climate_classifications`` classifies the climatology of the full
+record. `class_shifts` classifies every window of ``window`` years, moved
+by ``step`` years, to see where classes change. The day of year sums of
+every year are kept, so moving the window adds the sums of the new year and
+removes those of the oldest one instead of averaging all years of the
+window again. The cube is processed in tiles of whole chunks along the
+first spatial dimension; each chunk is read once.
+
+>>> shifts = class_shifts(ds[['gross_primary_productivity',
+...                           'air_temperature_2m', 'precipitation']],
+...                       window=10)
+>>> shifts.classes.sel(year=2015).plot()
+>>> shifts.changes.plot()
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .classification import (GPP_CLASSES, classify_dataset, cube_units,
+                             gpp_features, koppen_geiger)
+from .climatology import DayOfYearAccumulator, day_of_year
+from .streaming import as_time_array, template, time_blocks
+
+
+def gpp_classes(clim):
+    """`GPP_CLASSES` of a day of year climatology."""
+    return classify_dataset(gpp_features(clim), GPP_CLASSES)
+
+
+def koppen_geiger_classes(clim):
+    """Koppen-Geiger classes of a monthly climatology of the cube."""
+    temp, precip = cube_units(clim.air_temperature_2m, clim.precipitation)
+    return koppen_geiger(temp, precip)
+
+
+GROUPS = {
+    'dayofyear': (day_of_year, gpp_classes),
+    'month': (lambda time: pd.DatetimeIndex(time).month.values,
+              koppen_geiger_classes),
+}
+
+
+def _windows(obj, group, window, step, size):
+    """Yield ``(last year, accumulator)`` of every window of ``obj``."""
+    key = GROUPS[group][0]
+    years = deque()
+    total = DayOfYearAccumulator()
+    current = year_acc = None
+    first = None
+
+    def close():
+        nonlocal first
+        years.append(year_acc)
+        total.merge(year_acc)
+        if len(years) > window:
+            total.merge(years.popleft(), -1)
+        if len(years) == window:
+            first = current if first is None else first
+            if (current - first) % step == 0:
+                return True
+        return False
+
+    for time, values in time_blocks(obj, size):
+        year_of = pd.DatetimeIndex(time).year.values
+        for year in np.unique(year_of):
+            if year != current:
+                if current is not None and close():
+                    yield current, total
+                current, year_acc = year, DayOfYearAccumulator()
+            in_year = year_of == year
+            year_acc.add(key(time[in_year]), values[in_year])
+    if current is not None and close():
+        yield current, total
+
+
+def class_shifts(obj, window=10, step=1, group='dayofyear', classify=None,
+                 tile=None, size=None):
+    """Class maps of sliding windows of years and how often they change.
+
+    Parameters
+    ----------
+    obj : Dataset
+        Cube variables the classification needs, with a ``time`` dimension.
+    window : int
+        Years per window.
+    step : int
+        Years between the windows.
+    group : {'dayofyear', 'month'}
+        Climatology the classification is computed from.
+    classify : callable, optional
+        Takes the climatology of a window (Dataset with a ``group``
+        dimension) and returns a ``uint8`` class map. By default
+        `gpp_classes` for ``'dayofyear'`` and `koppen_geiger_classes` for
+        ``'month'``.
+    tile : int, optional
+        Entries of the first spatial dimension per tile, by default one
+        chunk (or 90).
+    size : int, optional
+        Time steps per block, by default the time chunk size.
+
+    Returns
+    -------
+    Dataset
+        ``classes`` (year, ...) with the classes of the window ending in
+        each year, ``changes`` the number of class changes between
+        consecutive windows per pixel and ``transitions`` (from_class,
+        to_class) the number of pixel changes between two classes.
+    """
+    classify = classify or GROUPS[group][1]
+    grid = template(obj)
+    if 'variable' in grid.dims:
+        grid = grid.isel(variable=0, drop=True)
+    first = grid.dims[0]
+    n_first = grid.sizes[first]
+    chunks = as_time_array(obj).chunksizes
+    if tile is None and chunks:
+        # follow the chunks, the first one may be partial after a selection
+        edges = np.r_[0, np.cumsum(chunks[first])]
+    else:
+        edges = np.r_[np.arange(0, n_first, tile or 90), n_first]
+
+    years, maps = None, []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        part = obj.isel({first: slice(start, stop)})
+        part_grid = grid.isel({first: slice(start, stop)})
+        tile_years, tile_maps = [], []
+        for year, acc in _windows(part, group, window, step, size):
+            clim = xr.Dataset(
+                {name: ((group,) + part_grid.dims, values)
+                 for name, values in zip(obj.data_vars,
+                                         np.moveaxis(acc.mean(), 1, 0))},
+                coords={group: acc.days, **part_grid.coords})
+            tile_years.append(year)
+            tile_maps.append(np.asarray(classify(clim), dtype=np.uint8))
+        years = tile_years
+        maps.append(np.stack(tile_maps) if tile_maps else None)
+    if not years:
+        raise ValueError(f'the record is shorter than {window} years')
+    classes = np.concatenate(maps, axis=1)
+
+    changed = classes[1:] != classes[:-1]
+    n = int(classes.max()) + 1
+    pairs = classes[:-1][changed].astype(int) * n + classes[1:][changed]
+    transitions = np.bincount(pairs, minlength=n * n).reshape(n, n)
+    return xr.Dataset({
+        'classes': (('year',) + grid.dims, classes),
+        'changes': (grid.dims, changed.sum(0).astype(np.int16)),
+        'transitions': (('from_class', 'to_class'), transitions),
+    }, coords={'year': years, 'from_class': np.arange(n),
+               'to_class': np.arange(n), **grid.coords})
@@ -0,0 +1,214 @@
+"""Significance of correlation maps.
+
+Two tests for every grid cell of a correlation map:
+
+* a t-test with the effective sample size of two autocorrelated series,
+  n_eff = n (1 - r1x r1y) / (1 + r1x r1y) (Bretherton et al. 1999), and
+* a block permutation (or block bootstrap) test of the index series. The
+  permuted index series form the columns of one matrix, so the correlations
+  of all cells with all permutations are a few matrix products per batch of
+  cells instead of a loop over cells and permutations.
+
+The field is read one slab (a chunk of the first spatial dimension) at a
+time. Its cells are split into batches of at most `MAX_ELEMENTS` cell and
+permutation pairs, which are spread over a thread pool; NumPy releases the
+GIL in the matrix products. Memory is bounded by one slab plus one batch per
+thread, whatever the grid and the number of permutations.
+
+>>> anomalies = monthly_anomalies(ds.precipitation)
+>>> sig = correlation_significance(sst_anomaly_5month, anomalies,
+...                                n_permutations=1000, workers=8)
+>>> sig.r.where(sig.p_value < 0.05).plot()
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.stats
+import xarray as xr
+
+# Cells times resampled series per batch, each (cells, n_permutations)
+# array of a batch takes 8 bytes per element
+MAX_ELEMENTS = 2**21
+
+
+def lag1_autocorrelation(values, axis=0):
+    """Lag-1 autocorrelation along ``axis``, skipping NaN pairs."""
+    values = np.moveaxis(np.asarray(values, dtype=float), axis, 0)
+    a, b = values[:-1], values[1:]
+    valid = np.isfinite(a) & np.isfinite(b)
+    n = valid.sum(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.where(valid, a - np.where(valid, a, 0).sum(0) / n, 0)
+        b = np.where(valid, b - np.where(valid, b, 0).sum(0) / n, 0)
+        r = (a * b).sum(0) / np.sqrt((a * a).sum(0) * (b * b).sum(0))
+    return np.where(n > 2, r, np.nan)
+
+
+def effective_sample_size(n, r1_x, r1_y):
+    """Effective number of independent pairs of two AR(1) like series."""
+    product = np.clip(np.asarray(r1_x) * np.asarray(r1_y), 0, 1 - 1E-9)
+    return np.clip(n * (1 - product) / (1 + product), 2, n)
+
+
+def ttest_pvalues(r, n):
+    """Two sided p-value of a correlation ``r`` from ``n`` independent pairs."""
+    dof = np.asarray(n, dtype=float) - 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.abs(r) * np.sqrt(dof / (1 - np.square(r)))
+    return 2 * scipy.stats.t.sf(t, np.maximum(dof, 1))
+
+
+def block_length(y):
+    """Decorrelation length of ``y`` in steps, (1 + r1) / (1 - r1) for AR(1)."""
+    r1 = float(np.nan_to_num(lag1_autocorrelation(y)))
+    r1 = min(max(r1, 0.), 0.99)
+    return max(1, int(round((1 + r1) / (1 - r1))))
+
+
+def resample_series(y, n_permutations, block=1, method='permutation',
+                    seed=None):
+    """Matrix of shape ``(len(y), n_permutations)`` with resampled copies of y.
+
+    ``method='permutation'`` shuffles the order of non overlapping blocks of
+    length ``block``, ``'bootstrap'`` draws overlapping blocks with
+    replacement (moving block bootstrap). Blocks keep the autocorrelation
+    of the series within them.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    rng = np.random.default_rng(seed)
+    n_blocks = math.ceil(n / block)
+    if method == 'permutation':
+        # shuffle the order of the blocks, the last one may be shorter
+        order = rng.permuted(np.tile(np.arange(n_blocks), (n_permutations, 1)),
+                             axis=1)
+        rank = np.argsort(order, axis=1)
+        key = rank[:, np.arange(n) // block] * block + np.arange(n) % block
+        positions = np.argsort(key, axis=1)
+    elif method == 'bootstrap':
+        starts = rng.integers(0, n, size=(n_permutations, n_blocks))
+        positions = (starts[:, :, None] + np.arange(block)).reshape(
+            n_permutations, -1)[:, :n] % n
+    else:
+        raise ValueError(f'unknown method {method!r}')
+    return y[positions].T
+
+
+def _slab_correlations(x, y_resampled, y):
+    """Observed and resampled correlations of the columns of ``x`` (time, cells)."""
+    valid_x = np.isfinite(x)
+    valid_y = np.isfinite(y)
+    mask = valid_x & valid_y[:, None]
+    n = mask.sum(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.where(mask, x, 0).sum(0) / n
+    xc = np.where(mask, x - mean_x, 0.)
+    mean_y = np.nanmean(y)
+
+    # missing index values move with the resampling, so x is masked by its
+    # own gaps only and the pairing is done by the products
+    xr_ = np.where(valid_x, x - mean_x, 0.)
+    yr = y_resampled - mean_y
+    valid_r = np.isfinite(yr)
+    yr = np.where(valid_r, yr, 0.)
+    sxy = xr_.T @ yr
+    syy = valid_x.T.astype(float) @ (yr * yr)
+    if valid_r.all():
+        sxx = (xr_ * xr_).sum(0)[:, None]
+    else:
+        sxx = (xr_ * xr_).T @ valid_r.astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r_resampled = sxy / np.sqrt(sxx * syy)
+
+    yc = np.where(valid_y, y - mean_y, 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (xc.T @ yc) / np.sqrt((xc * xc).sum(0)
+                                  * (valid_x.T.astype(float) @ (yc * yc)))
+    return r, r_resampled, n
+
+
+def correlation_significance(index, field, n_permutations=1000, block=None,
+                             method='permutation', workers=None, slab=None,
+                             seed=None):
+    """Correlation of ``field`` with ``index`` and its significance per cell.
+
+    Parameters
+    ----------
+    index : DataArray
+        Time series, e.g. the Nino 3.4 anomaly.
+    field : DataArray
+        Cube variable on the same time steps (e.g. monthly anomalies from
+        `esc.anomalies.monthly_anomalies`); only common time stamps are used.
+    n_permutations : int
+        Number of resampled index series.
+    block : int, optional
+        Block length in time steps, by default `block_length` of the index.
+    method : {'permutation', 'bootstrap'}
+        See `resample_series`.
+    workers : int, optional
+        Threads working on batches of cells in parallel.
+    slab : int, optional
+        Entries of the first spatial dimension read at a time, by default
+        one chunk (or 90).
+    seed : int, optional
+        Seed of the random number generator.
+
+    Returns
+    -------
+    Dataset
+        ``r`` the correlation, ``p_value`` from the resampling test,
+        ``n_eff`` the effective sample size and ``p_ttest`` the t-test with
+        ``n_eff``.
+    """
+    field, index = xr.align(field.transpose('time', ...), index, join='inner')
+    y = np.asarray(index.values, dtype=float)
+    block = block or block_length(y)
+    y_resampled = resample_series(y, n_permutations, block, method, seed)
+    r1_y = lag1_autocorrelation(y)
+
+    grid = field.isel(time=0, drop=True)
+    first = grid.dims[0]
+    n_first = grid.sizes[first]
+    if slab is None and field.chunks:
+        # follow the chunks, the first one may be partial after a selection
+        edges = np.r_[0, np.cumsum(field.chunksizes[first])]
+    else:
+        edges = np.r_[np.arange(0, n_first, slab or 90), n_first]
+
+    # cells per batch, so that the (cells, n_permutations) products stay small
+    batch = max(1, MAX_ELEMENTS // n_permutations)
+
+    def work(x, cells):
+        r, r_resampled, n = _slab_correlations(x[:, cells], y_resampled, y)
+        # resamples equal to the observed series (e.g. a single block) tie
+        # with it; count them whatever the rounding of the matrix products
+        exceed = (np.abs(r_resampled) >= np.abs(r)[:, None] - 1E-12).sum(1)
+        return r, (exceed + 1) / (n_permutations + 1), n
+
+    slabs = []
+    with ThreadPoolExecutor(workers) as pool:
+        for start, stop in zip(edges[:-1], edges[1:]):
+            x = np.asarray(field.isel({first: slice(start, stop)}).values,
+                           dtype=float)
+            shape = x.shape[1:]
+            x = x.reshape(len(x), -1)
+            r = np.full(x.shape[1], np.nan)
+            p = np.full(x.shape[1], np.nan)
+            n = np.zeros(x.shape[1])
+            # cells without data (e.g. GPP over the ocean) skip the products
+            cells = np.flatnonzero(np.isfinite(x).sum(0) > 2)
+            batches = [cells[i:i + batch] for i in range(0, len(cells), batch)]
+            results = pool.map(work, [x] * len(batches), batches)
+            for b, (r_b, p_b, n_b) in zip(batches, results):
+                r[b], p[b], n[b] = r_b, p_b, n_b
+            n_eff = effective_sample_size(n, lag1_autocorrelation(x), r1_y)
+            slabs.append([a.reshape(shape) for a in (r, p, n_eff)])
+    r, p, n_eff = (np.concatenate(parts) for parts in zip(*slabs))
+    return xr.Dataset({
+        'r': (grid.dims, r),
+        'p_value': (grid.dims, p),
+        'n_eff': (grid.dims, n_eff),
+        'p_ttest': (grid.dims, ttest_pvalues(r, n_eff)),
+    }, coords=grid.coords)
@@ -0,0 +1,132 @@
+"""Rolling means and extremes of many series at once.
+
+``05-Anomalies`` smooths every regional anomaly with
+
+    pd.Series(sst.values.flatten()).rolling(window=5).mean().iloc[5-1:]
+
+and finds the peaks with ``np.partition(sst_smooth.flatten(), -2)``. Here
+`rolling_mean` smooths all pixels or regions of an array together with a
+cumulative sum (two passes over the data whatever the window) and
+`extremes` returns the k largest and smallest values with their dates in
+one call.
+
+>>> smooth = rolling_mean(nino34_anomaly, 5, center=True)
+>>> peaks = extremes(smooth, k=3, separation=12)
+>>> peaks.max_time.values
+"""
+
+import numpy as np
+import xarray as xr
+
+
+def _rolling_mean(values, window, center=False, min_periods=None):
+    """Rolling mean along the last axis of a NumPy array, NaN skipped."""
+    values = np.asarray(values, dtype=float)
+    min_periods = window if min_periods is None else min_periods
+    finite = np.isfinite(values)
+    pad = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    total = np.pad(np.where(finite, values, 0.).cumsum(-1), pad)
+    count = np.pad(finite.cumsum(-1), pad)
+    # window of step i: [i - before, i + after], cut at the ends of the
+    # series, so partial windows count if they have min_periods values
+    before = window // 2 if center else window - 1
+    after = window - 1 - before
+    steps = np.arange(values.shape[-1])
+    lo = np.clip(steps - before, 0, None)
+    hi = np.clip(steps + after + 1, None, len(steps))
+    window_total = total[..., hi] - total[..., lo]
+    window_count = count[..., hi] - count[..., lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_count >= max(min_periods, 1),
+                        window_total / window_count, np.nan)
+
+
+def rolling_mean(obj, window, dim='time', center=False, min_periods=None):
+    """Rolling mean of ``obj`` along ``dim`` for all other elements at once.
+
+    Same as ``obj.rolling({dim: window}, center=center,
+    min_periods=min_periods).mean()``, and with ``center=False`` as the
+    pandas ``rolling(window).mean()`` of every series: windows with fewer
+    than ``min_periods`` (default ``window``) values are NaN. Works on
+    NumPy arrays (along the last axis), DataArrays and Datasets; dask arrays
+    are processed chunk by chunk with ``dim`` in one chunk.
+    """
+    if not isinstance(obj, (xr.DataArray, xr.Dataset)):
+        return _rolling_mean(obj, window, center, min_periods)
+    if obj.chunks:
+        obj = obj.chunk({dim: -1})
+    return xr.apply_ufunc(_rolling_mean, obj, input_core_dims=[[dim]],
+                          output_core_dims=[[dim]],
+                          kwargs={'window': window, 'center': center,
+                                  'min_periods': min_periods},
+                          dask='parallelized', output_dtypes=[float])
+
+
+def _top_k(values, k, separation=None):
+    """Positions of the k largest values along the last axis (-1 if none)."""
+    filled = np.where(np.isnan(values), -np.inf, values)
+    n = values.shape[-1]
+    k = min(k, n)
+    if separation is None:
+        part = np.argpartition(-filled, k - 1, axis=-1)[..., :k]
+        order = np.argsort(-np.take_along_axis(filled, part, -1), axis=-1)
+        positions = np.take_along_axis(part, order, -1)
+        found = np.isfinite(np.take_along_axis(filled, positions, -1))
+    else:
+        # greedy: take the largest, then blank its neighbourhood
+        positions = np.empty(values.shape[:-1] + (k,), dtype=int)
+        found = np.empty(values.shape[:-1] + (k,), dtype=bool)
+        steps = np.arange(n)
+        for rank in range(k):
+            best = filled.argmax(-1)
+            positions[..., rank] = best
+            # nothing left once every step is blanked or NaN
+            found[..., rank] = np.isfinite(
+                np.take_along_axis(filled, best[..., None], -1)[..., 0])
+            near = np.abs(steps - best[..., None]) < separation
+            filled = np.where(near, -np.inf, filled)
+    return np.where(found, positions, -1)
+
+
+def extremes(da, k=1, dim='time', separation=None):
+    """The ``k`` largest and smallest values of ``da`` along ``dim``.
+
+    Parameters
+    ----------
+    da : DataArray
+        E.g. a smoothed anomaly series or cube; all other dimensions are
+        searched at once.
+    k : int
+        Number of extremes of each sign.
+    dim : str
+        Dimension to search.
+    separation : int, optional
+        Minimum distance in steps between two extremes of the same sign, so
+        that one long event is not counted k times. By default neighbouring
+        steps may both be extremes, like ``np.partition``.
+
+    Returns
+    -------
+    Dataset
+        With a ``rank`` dimension (0 is the most extreme): ``max_value``,
+        ``max_<dim>``, ``min_value`` and ``min_<dim>``; NaN (NaT) where
+        fewer than ``k`` values were found.
+    """
+    da = da.transpose(..., dim)
+    values = np.asarray(da.values, dtype=float)
+    coord = da[dim].values
+    other = da.isel({dim: 0}, drop=True)
+    result = {}
+    for kind, sign in (('max', 1), ('min', -1)):
+        positions = _top_k(sign * values, k, separation)
+        found = positions >= 0
+        index = np.where(found, positions, 0)
+        value = np.where(found, np.take_along_axis(values, index, -1), np.nan)
+        at = coord[index]
+        missing = np.datetime64('NaT') if at.dtype.kind == 'M' else np.nan
+        at = np.where(found, at, missing) if at.dtype.kind in 'Mf' else at
+        dims = other.dims + ('rank',)
+        result[f'{kind}_value'] = (dims, value)
+        result[f'{kind}_{dim}'] = (dims, at)
+    return xr.Dataset(result, coords={**other.coords,
+                                      'rank': np.arange(value.shape[-1])})
@@ -0,0 +1,101 @@
+"""Annual and monthly anomalies of many stations at once.
+
+``05-Anomalies`` computes the Leipzig anomaly as
+
+    annual = leipzig.resample(time='Y').mean()
+    annual - annual.mean()          # or annual - (9.1 + 273.15)
+
+`station_anomalies` does this for a table of stations in one go: their
+series are read with `esc.points.extract_points`, averaged per year or month
+for all stations together and compared to a baseline per station, either
+the mean over its own baseline years or a given reference value.
+
+>>> stations = pd.DataFrame({'lat': [51.3, 52.5], 'lon': [12.3, 13.4],
+...                          'reference': [9.1 + 273.15, np.nan],
+...                          'baseline_start': [np.nan, 2001],
+...                          'baseline_end': [np.nan, 2010]},
+...                         index=['Leipzig', 'Berlin'])
+>>> table = station_anomalies(ds.air_temperature_2m, stations).to_pandas()
+"""
+
+import warnings
+
+import numpy as np
+
+from .points import extract_points
+
+FREQUENCIES = {'year': 'YS', 'month': 'MS'}
+
+
+def _column(stations, name, n):
+    if name in stations:
+        return np.asarray(stations[name], dtype=float)
+    return np.full(n, np.nan)
+
+
+def baseline_anomalies(means, start=None, end=None, reference=None,
+                       freq='year'):
+    """Anomalies of annual or monthly ``means`` with dims (time, point).
+
+    ``start`` and ``end`` are the first and last baseline year of every
+    point (NaN: the first or last year of the record); ``reference`` a fixed
+    baseline value per point which takes precedence where it is not NaN.
+    Monthly anomalies are relative to the baseline mean of the same
+    calendar month.
+    """
+    n = means.sizes['point']
+    years = means['time'].dt.year.values
+    start = np.full(n, -np.inf) if start is None else \
+        np.where(np.isnan(start), -np.inf, start)
+    end = np.full(n, np.inf) if end is None else \
+        np.where(np.isnan(end), np.inf, end)
+    in_base = (years[:, None] >= start) & (years[:, None] <= end)
+    values = np.asarray(means.transpose('time', 'point').values, dtype=float)
+    base = np.where(in_base, values, np.nan)
+    with warnings.catch_warnings():
+        # stations without data in their baseline get NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if freq == 'month':
+            months = means['time'].dt.month.values
+            clim = np.full((12, n), np.nan)
+            for month in np.unique(months):
+                clim[month - 1] = np.nanmean(base[months == month], 0)
+            baseline = clim[months - 1]
+        else:
+            baseline = np.nanmean(base, 0)[None]
+    if reference is not None:
+        reference = np.asarray(reference, dtype=float)
+        baseline = np.where(np.isnan(reference), baseline, reference)
+    return means.transpose('time', 'point').copy(data=values - baseline)
+
+
+def station_anomalies(da, stations, freq='year'):
+    """Annual or monthly anomalies of ``da`` at all ``stations``.
+
+    Parameters
+    ----------
+    da : DataArray
+        Cube variable with dims (time, lat, lon).
+    stations : pandas.DataFrame
+        One row per station with columns ``lat`` and ``lon`` and optionally
+        ``baseline_start`` and ``baseline_end`` (years) and ``reference``
+        (baseline value in the units of ``da``). Without them the baseline
+        is the mean of the whole record, as in the notebook.
+    freq : {'year', 'month'}
+        Resolution of the anomalies.
+
+    Returns
+    -------
+    DataArray
+        Anomalies with dims (time, point), the points labelled by the index
+        of ``stations``; ``.to_pandas()`` gives the table.
+    """
+    if freq not in FREQUENCIES:
+        raise ValueError(f'unknown frequency {freq!r}')
+    n = len(stations)
+    series = extract_points(da, stations['lat'], stations['lon'],
+                            names=np.asarray(stations.index))
+    means = series.resample(time=FREQUENCIES[freq]).mean()
+    return baseline_anomalies(means, _column(stations, 'baseline_start', n),
+                              _column(stations, 'baseline_end', n),
+                              _column(stations, 'reference', n), freq)
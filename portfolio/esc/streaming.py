@@ -0,0 +1,106 @@
+"""Reading the cube block by block along time.
+
+Operations like ``resample(time='M').mean()`` followed by ``groupby`` build
+large task graphs and read the data several times. The helpers here walk
+once through the time axis, one block of whole chunks at a time, so that
+reductions can be accumulated in memory that does not grow with the length
+of the record.
+
+Variables of a Dataset are read together and stacked along a leading
+``variable`` axis, i.e. every block holds all of them.
+"""
+
+import numpy as np
+import xarray as xr
+
+
+def as_time_array(obj):
+    """DataArray with ``time`` as first dimension; Datasets are stacked."""
+    if isinstance(obj, xr.Dataset):
+        obj = obj.to_array('variable')
+    return obj.transpose('time', ...)
+
+
+def template(obj):
+    """Lazy DataArray of one time step, to rebuild results on the same grid."""
+    return as_time_array(obj).isel(time=0, drop=True)
+
+
+def wrap(values, like, dims, coords):
+    """Put ``values`` on the grid of ``like`` with new leading ``dims``.
+
+    Returns a Dataset if ``like`` was built from one by `as_time_array`.
+    """
+    grid = template(like)
+    da = xr.DataArray(values, dims=tuple(dims) + grid.dims,
+                      coords={**coords, **grid.coords}, name=grid.name)
+    if isinstance(like, xr.Dataset):
+        return da.to_dataset('variable')
+    return da
+
+
+def block_bounds(obj, size=None):
+    """Start and stop positions of consecutive blocks along time.
+
+    By default the blocks are the time chunks themselves, so every chunk is
+    read exactly once even if the first one is partial, e.g. after
+    ``isel(time=slice(20, None))``. A ``size`` gives blocks of that many
+    steps instead.
+    """
+    da = as_time_array(obj)
+    n = da.sizes['time']
+    if size:
+        edges = np.r_[np.arange(0, n, size), n]
+    elif da.chunks is None:
+        edges = np.array([0, n])
+    else:
+        edges = np.r_[0, np.cumsum(da.chunks[0])]
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def time_blocks(obj, size=None):
+    """Yield ``(time, values)`` for consecutive blocks along time.
+
+    The blocks follow the time chunks unless ``size`` is given, see
+    `block_bounds`. ``values`` is a NumPy array with time on the first axis.
+    """
+    da = as_time_array(obj)
+    for start, stop in block_bounds(da, size):
+        block = da.isel(time=slice(start, stop))
+        yield block['time'].values, np.asarray(block.values)
+
+
+def nansum_count(values, axis=0):
+    """Sum over the finite values and their number along ``axis``."""
+    finite = np.isfinite(values)
+    return np.where(finite, values, 0).sum(axis), finite.sum(axis)
+
+
+def iter_monthly_means(obj, size=None):
+    """Yield ``(month, mean)`` for every calendar month of the record.
+
+    Equivalent to ``obj.resample(time='M').mean()`` with NaN skipped, but
+    streamed: a month split over two blocks is carried over to the next one.
+    ``month`` is a ``numpy.datetime64`` with month precision.
+    """
+    current = total = count = None
+    for time, values in time_blocks(obj, size):
+        months = time.astype('datetime64[M]')
+        # positions where a new month begins inside this block
+        starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        for start, stop in zip(starts, np.r_[starts[1:], len(months)]):
+            block_sum, block_count = nansum_count(values[start:stop])
+            if months[start] == current:
+                total += block_sum
+                count += block_count
+                continue
+            if current is not None:
+                yield current, _mean(total, count)
+            current, total, count = months[start], block_sum, block_count
+    if current is not None:
+        yield current, _mean(total, count)
+
+
+def _mean(total, count):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
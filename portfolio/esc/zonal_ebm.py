@@ -0,0 +1,164 @@
+"""Latitude resolved (zonal mean) energy balance model.
+
+A Budyko/Sellers type model on the latitude grid of the Earth System Data
+Cube. Every latitude band balances absorbed sunlight against linearised
+outgoing radiation and exchanges heat with its neighbours by diffusion:
+
+    C dT/dt = S(x) (1 - albedo(T)) - (A + B T) + d/dx (D (1 - x^2) dT/dx)
+
+with x = sin(lat) and T in degree Celsius. The bands are finite volumes whose
+width in x is proportional to their area on the sphere (compare ``cell_area``
+in ``04-Computation-concepts``), so the diffusion conserves energy.
+
+Diffusion and the B T term are treated implicitly with a sparse tridiagonal
+matrix which is factorised once per step size; only the ice albedo feedback
+is explicit. The step is therefore not limited by the grid spacing and a 200
+year run at 0.25 degree takes a fraction of a second:
+
+>>> model = ZonalEBM(resolution=0.25)
+>>> temp = model.run(np.arange(0, 200.1, 0.1))
+"""
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+from .energy_balance import L, SECONDS_PER_YEAR, heat_capacity
+
+# Parameters of North (1975) and Budyko (1969)
+A = 203.3           # outgoing radiation at 0 degC [W/m2]
+B = 2.09            # increase of the outgoing radiation [W/(m2 K)]
+D = 0.55            # diffusion coefficient [W/(m2 K)]
+S2 = -0.482         # second Legendre coefficient of the annual insolation
+ALBEDO_ICE = 0.62   # []
+ALBEDO_FREE = 0.3   # []
+T_ICE = -10.        # temperature below which a band is ice covered [degC]
+DEPTH = 50.         # depth of the ocean mixed layer [m]
+
+
+def latitude_grid(resolution=2.5):
+    """Cell centres of a global latitude grid ordered north to south like the cube."""
+    return np.arange(90 - resolution / 2, -90, -resolution)
+
+
+def latitude_edges(lat):
+    """Cell edges of the latitude cell centres ``lat``, from the first to the last."""
+    lat = np.asarray(lat, dtype=float)
+    mid = (lat[1:] + lat[:-1]) / 2
+    sign = np.sign(lat[0] - lat[-1])
+    return np.concatenate([[90 * sign], mid, [-90 * sign]])
+
+
+class ZonalEBM:
+    """Zonal mean energy balance model.
+
+    Parameters
+    ----------
+    lat : array_like, optional
+        Latitudes of the band centres [deg], e.g. ``ds.lat`` of the cube.
+        Defaults to a global grid with ``resolution``.
+    resolution : float
+        Grid spacing [deg] if ``lat`` is not given.
+    l : float
+        Solar constant [W/m2].
+    a, b, d : float
+        Radiation and diffusion parameters, see the module constants.
+    depth : float
+        Depth of the mixed layer [m], sets the heat capacity.
+    """
+
+    def __init__(self, lat=None, resolution=2.5, l=L, a=A, b=B, d=D,
+                 depth=DEPTH, albedo_ice=ALBEDO_ICE, albedo_free=ALBEDO_FREE,
+                 t_ice=T_ICE):
+        self.lat = latitude_grid(resolution) if lat is None \
+            else np.asarray(lat, dtype=float)
+        self.a, self.b, self.d = a, b, d
+        self.albedo_ice, self.albedo_free, self.t_ice = \
+            albedo_ice, albedo_free, t_ice
+        self.capacity = heat_capacity(depth)
+
+        x = np.sin(np.deg2rad(self.lat))
+        x_edges = np.sin(np.deg2rad(latitude_edges(self.lat)))
+        self.x = x
+        # width of the bands in x, proportional to their area
+        self.dx = np.abs(np.diff(x_edges))
+        self.insolation = l / 4 * (1 + S2 * (3 * x**2 - 1) / 2)
+        self.diffusion = self._diffusion_operator(x, x_edges[1:-1])
+        self._solvers = {}
+
+    def _diffusion_operator(self, x, x_inner):
+        """Sparse matrix of d/dx (D (1 - x^2) dT/dx) [W/(m2 K)]."""
+        # conductance across the inner edges, zero flux through the poles
+        k = self.d * (1 - x_inner**2) / np.abs(np.diff(x))
+        n = len(x)
+        main = np.zeros(n)
+        main[:-1] -= k
+        main[1:] -= k
+        operator = scipy.sparse.diags([k, main, k], [-1, 0, 1], format='csc')
+        return scipy.sparse.diags(1 / self.dx) @ operator
+
+    def albedo(self, temp):
+        """Ice albedo below ``t_ice``, otherwise the ice free albedo."""
+        return np.where(temp < self.t_ice, self.albedo_ice, self.albedo_free)
+
+    def forcing(self, temp):
+        """Explicit part of the energy budget [W/m2]."""
+        albedo = self.albedo(temp)
+        if temp.ndim > 1:
+            return self.insolation[:, None] * (1 - albedo) - self.a
+        return self.insolation * (1 - albedo) - self.a
+
+    def rate(self, temp):
+        """Temperature tendency dT/dt [K/year]."""
+        flux = self.forcing(temp) - self.b * temp + self.diffusion @ temp
+        return flux * SECONDS_PER_YEAR / self.capacity
+
+    def _solver(self, step):
+        """LU factorisation of the implicit operator for ``step`` years."""
+        if step not in self._solvers:
+            n = len(self.lat)
+            k = SECONDS_PER_YEAR / self.capacity
+            matrix = scipy.sparse.identity(n, format='csc') / step \
+                + k * (self.b * scipy.sparse.identity(n, format='csc')
+                       - self.diffusion)
+            self._solvers[step] = scipy.sparse.linalg.splu(matrix.tocsc())
+        return self._solvers[step]
+
+    def step(self, temp, step):
+        """Advance ``temp`` by ``step`` years with a semi-implicit Euler step."""
+        k = SECONDS_PER_YEAR / self.capacity
+        return self._solver(step).solve(temp / step + k * self.forcing(temp))
+
+    def run(self, time, temp0=10.):
+        """Integrate the model.
+
+        Parameters
+        ----------
+        time : array_like
+            Output times [years], the step between two entries is the
+            integration step.
+        temp0 : float or array_like
+            Initial temperature [degC], a scalar, one value per band or an
+            array of shape ``(len(lat), members)`` for an ensemble of
+            initial states.
+
+        Returns
+        -------
+        numpy.ndarray
+            Temperatures of shape ``(len(time),) + np.shape(temp0)``, with the
+            band axis first after the time axis [degC].
+        """
+        time = np.asarray(time, dtype=float)
+        temp0 = np.asarray(temp0, dtype=float)
+        if temp0.ndim == 0:
+            temp0 = np.full(len(self.lat), float(temp0))
+        temp = np.empty((len(time),) + temp0.shape)
+        temp[0] = temp0
+        # round the steps so that a regular time axis uses one factorisation
+        for k, step in enumerate(np.round(np.diff(time), 12)):
+            temp[k + 1] = self.step(temp[k], step)
+        return temp
+
+    def global_mean(self, temp, axis=-1):
+        """Area weighted mean over the band axis ``axis``."""
+        return np.average(temp, axis=axis, weights=self.dx)
@@ -0,0 +1,113 @@
+"""Tests of the chunk cache against a local zarr store served over HTTP.
+
+Run from ``portfolio/`` with ``python -m pytest tests``.
+"""
+
+import collections
+import functools
+import http.server
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from esc.cube import CacheMiss, ChunkCache, fingerprint, open_cube
+
+CHUNKS = {'time': 5, 'lat': 5, 'lon': 10}
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def served(tmp_path_factory):
+    """A small cube written to disk and served by ``http.server``."""
+    root = tmp_path_factory.mktemp('www')
+    rng = np.random.default_rng(0)
+    ds = xr.Dataset(
+        {'sst': (('time', 'lat', 'lon'),
+                 rng.normal(290, 5, (20, 10, 20)).astype('float32'))},
+        coords={'time': pd.date_range('2000-01-01', periods=20, freq='8D'),
+                'lat': np.arange(4.5, -5, -1.), 'lon': np.arange(-9.5, 10)})
+    ds.chunk(CHUNKS).to_zarr(root / 'cube.zarr', consolidated=True)
+    handler = functools.partial(_QuietHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/cube.zarr', ds
+    server.shutdown()
+    server.server_close()
+
+
+def _open(url, cache_dir, **kwargs):
+    cache = ChunkCache(url, cache_dir, **kwargs)
+    return cache, xr.open_zarr(cache, consolidated=True)
+
+
+def _read_sst(cache, ds):
+    """Counters of the cache while reading the data variable."""
+    before = collections.Counter(cache.stats)
+    values = ds.sst.values
+    return values, cache.stats - before
+
+
+def test_second_open_only_hits(served, tmp_path):
+    url, expected = served
+    n_chunks = 4 * 2 * 2
+    cache, ds = _open(url, tmp_path)
+    values, cold = _read_sst(cache, ds)
+    np.testing.assert_array_equal(values, expected.sst.values)
+    # every chunk is downloaded once and counted once
+    assert cold['misses'] == n_chunks
+    assert cold['hits'] == 0
+    assert cold['bytes_read'] == cold['bytes_fetched'] > 0
+
+    cache, ds = _open(url, tmp_path)
+    values, warm = _read_sst(cache, ds)
+    np.testing.assert_array_equal(values, expected.sst.values)
+    assert warm['hits'] == n_chunks
+    assert warm['misses'] == 0
+    assert warm['bytes_fetched'] == 0
+    assert warm['bytes_read'] == cold['bytes_read']
+
+
+def test_offline_without_cache(served, tmp_path):
+    url, _ = served
+    with pytest.raises(CacheMiss):
+        open_cube(url, cache_dir=tmp_path, offline=True)
+    assert fingerprint(url, offline=True, cache_dir=tmp_path) is None
+
+
+def test_offline_after_eviction(served, tmp_path):
+    url, expected = served
+    cache, ds = _open(url, tmp_path, max_size=5000)
+    ds.sst.values
+    keys = {cache._peek(path)[0] for path in cache._index()}
+    assert {'.zmetadata', 'time/0', 'lat/0', 'lon/0'} <= keys
+    assert 0 < sum(key.startswith('sst/') for key in keys) < 16
+
+    # metadata and coordinates survive, so the cube opens without network
+    digest = fingerprint(url, offline=True, cache_dir=tmp_path)
+    assert digest == fingerprint(url, cache_dir=tmp_path)
+    ds = open_cube(url, cache_dir=tmp_path, offline=True)
+    np.testing.assert_array_equal(ds.time.values, expected.time.values)
+    with pytest.raises(CacheMiss):
+        ds.sst.values
+
+
+def test_truncated_file_is_fetched_again(served, tmp_path):
+    url, expected = served
+    _, ds = _open(url, tmp_path)
+    ds.sst.values
+    cache = ChunkCache(url, tmp_path)
+    path = cache._path('sst/0.0.0')
+    path.write_bytes(path.read_bytes()[:20])
+
+    cache, ds = _open(url, tmp_path)
+    np.testing.assert_array_equal(ds.sst.values, expected.sst.values)
+    assert cache.stats['misses'] == 1
+    assert path.stat().st_size > 20